@@ -2,10 +2,17 @@ import json
 from dotenv import load_dotenv
 load_dotenv()
 
-from groq import Groq
 import os
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 
 # Tools
@@ -54,49 +61,50 @@ tools = [
     },
 ]
 
-# Query
-query = (
-    "Task: Calculate 55 + 21, then subtract 10 from the result."
-    "You must complete the entire task using multiple tool calls if needed."
-    "After executing the first tool call, continue reasoning and call the next tool."
-    "Do not stop until the final result is reached."
-)
+if __name__ == "__main__":
+    # Query
+    query = (
+        "Task: Calculate 55 + 21, then subtract 10 from the result."
+        "You must complete the entire task using multiple tool calls if needed."
+        "After executing the first tool call, continue reasoning and call the next tool."
+        "Do not stop until the final result is reached."
+    )
 
-# Calling groq
-response = client.chat.completions.create(
-    model="llama-3.3-70b-versatile",
-    messages=[{"role": "user", "content": query}],
-    tools=tools,
-)
+    # Calling groq
+    response = get_client().chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=[{"role": "user", "content": query}],
+        tools=tools,
+    )
 
-print("\nRAW RESPONSE:\n", response, "\n")
+    print("\nRAW RESPONSE:\n", response, "\n")
 
-#Handling Tool calls
-msg = response.choices[0].message
+    #Handling Tool calls
+    msg = response.choices[0].message
 
-if msg.tool_calls:
-    for call in msg.tool_calls:
+    if msg.tool_calls:
+        for call in msg.tool_calls:
 
-        fn_name = call.function.name
-        raw_args = call.function.arguments
+            fn_name = call.function.name
+            raw_args = call.function.arguments
 
-        print("Raw args string:", raw_args)
+            print("Raw args string:", raw_args)
 
-        try:
-            args = json.loads(raw_args)
+            try:
+                args = json.loads(raw_args)
 
-            # If model returns array instead of object
-            if isinstance(args, list) and len(args) == 1 and isinstance(args[0], dict):
-                args = args[0]
+                # If model returns array instead of object
+                if isinstance(args, list) and len(args) == 1 and isinstance(args[0], dict):
+                    args = args[0]
 
-        except json.JSONDecodeError:
-            raise ValueError("Model returned invalid JSON for tool arguments.")
+            except json.JSONDecodeError:
+                raise ValueError("Model returned invalid JSON for tool arguments.")
 
-        print(f"Tool called: {fn_name}, args={args}")
+            print(f"Tool called: {fn_name}, args={args}")
 
-        # Execute tool
-        result = TOOL_FUNCTIONS[fn_name](**args)
-        print("Tool result:", result)
+            # Execute tool
+            result = TOOL_FUNCTIONS[fn_name](**args)
+            print("Tool result:", result)
 
 
 # Expected Output:- 
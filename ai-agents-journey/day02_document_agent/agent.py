@@ -2,10 +2,17 @@ import json
 from dotenv import load_dotenv
 load_dotenv()
 
-from groq import Groq
 import os
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 # Python tool to read files
 
@@ -40,52 +47,53 @@ tools = [
     }
 ]
 
-# User Task
+if __name__ == "__main__":
+    # User Task
 
-query = (
-    "Read the file './sample.txt' and summarize it in 4 bullet points."
-)
+    query = (
+        "Read the file './sample.txt' and summarize it in 4 bullet points."
+    )
 
-response = client.chat.completions.create(
-    model = "llama-3.3-70b-versatile",
-    messages = [{"role":"user","content": query}],
-    tools=tools
-)
+    response = get_client().chat.completions.create(
+        model = "llama-3.3-70b-versatile",
+        messages = [{"role":"user","content": query}],
+        tools=tools
+    )
 
-print("\nRAW RESPONSE:\n", response, "\n")
+    print("\nRAW RESPONSE:\n", response, "\n")
 
-msg = response.choices[0].message
+    msg = response.choices[0].message
 
-# Handle Tool call
+    # Handle Tool call
 
-if msg.tool_calls:
-    for call in msg.tool_calls:
-        fn_name = call.function.name
-        raw_args = call.function.arguments
+    if msg.tool_calls:
+        for call in msg.tool_calls:
+            fn_name = call.function.name
+            raw_args = call.function.arguments
 
-        print("Raw args:", raw_args)
+            print("Raw args:", raw_args)
 
-        args = json.loads(raw_args)
-        result = TOOL_FUNCTIONS[fn_name](**args)
+            args = json.loads(raw_args)
+            result = TOOL_FUNCTIONS[fn_name](**args)
 
-        print("\nTool result (file content):\n", result)
+            print("\nTool result (file content):\n", result)
 
-        # Send Result back to the model
+            # Send Result back to the model
 
-        followup = client.chat.completions.create(
-            model = "llama-3.3-70b-versatile",
-            messages=[
-                {"role":"user", "content": query},
-                {"role":"assistant", "tool_calls": msg.tool_calls},
-                {
-                    "role": "tool",
-                    "tool_call_id": call.id,   
-                    "content": result
-                }
-            ]
-        )
+            followup = get_client().chat.completions.create(
+                model = "llama-3.3-70b-versatile",
+                messages=[
+                    {"role":"user", "content": query},
+                    {"role":"assistant", "tool_calls": msg.tool_calls},
+                    {
+                        "role": "tool",
+                        "tool_call_id": call.id,   
+                        "content": result
+                    }
+                ]
+            )
 
-        print("\n FINAL SUMMARY: \n", followup.choices[0].message.content)
+            print("\n FINAL SUMMARY: \n", followup.choices[0].message.content)
 
 
 
@@ -2,14 +2,21 @@
 # Day 3 → Agent loop handles multi-step behavior automatically → No need to instruct it in the prompt.
 
 
-from groq import Groq
 import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 def add(a,b):
     return a + b
@@ -72,7 +79,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
@@ -109,8 +116,9 @@ def run_agent(user_query):
         else:
             break
 
-query = "Do (100+1000)., then multiply the result by 3, then subtract 10 from the result."
-run_agent(query)
+if __name__ == "__main__":
+    query = "Do (100+1000)., then multiply the result by 3, then subtract 10 from the result."
+    run_agent(query)
 
 
 
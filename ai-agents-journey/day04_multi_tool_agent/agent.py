@@ -1,10 +1,17 @@
 import os, json, datetime, random
-from groq import Groq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 def add(a,b):
     return a + b
@@ -125,7 +132,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
@@ -163,13 +170,14 @@ def run_agent(user_query):
         else:
             break
 
-query = (
-    "1) Add 10 and 45 as a quick test. "
-    "2) Then read the file './sample.txt' and summarize it in 4 bullet points. "
-    "3) Finally generate a random number from 1 to 100."
-)
+if __name__ == "__main__":
+    query = (
+        "1) Add 10 and 45 as a quick test. "
+        "2) Then read the file './sample.txt' and summarize it in 4 bullet points. "
+        "3) Finally generate a random number from 1 to 100."
+    )
 
-run_agent(query)
+    run_agent(query)
 
 
 # Expected Output:-
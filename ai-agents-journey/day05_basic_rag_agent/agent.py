@@ -23,37 +23,145 @@
 # We’ll rely on keyword search (not embeddings yet).
 
 
-import os,json
-from groq import Groq
+import os,re,json,math,time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
-
-# Simple retrieval function
-
-def search_docs(query):
-    docs_folder = "./docs"
-
-    for filename in os.listdir(docs_folder):
-        if filename.endswith(".txt"):
-            path = os.path.join(docs_folder, filename)
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+DOCS_PATH = "./docs"
+MAX_RESULTS = 5
+SNIPPETS_PER_FILE = 2
+SNIPPET_WINDOW = 8          # words on each side of a match
+REFRESH_INTERVAL = 2.0      # seconds between checks of the docs folder
+
+
+# In-memory inverted index over ./docs
+#
+# term -> {filename: [token positions]}
+# A file is re-indexed only when its mtime or size changes, and the folder is
+# stat-ed at most once per REFRESH_INTERVAL, so a search only touches the
+# postings of the query terms instead of re-reading every file.
+
+DOC_INDEX = {
+    "postings": {},
+    "files": {},
+    "checked_at": None
+}
 
-            with open(path, "r", encoding="utf-8") as f:
-                text = f.read()
+def tokenize(text):
+    return [(m.group(0).lower(), m.start(), m.end()) for m in re.finditer(r"\w+", text)]
+
+def remove_file(filename):
+    entry = DOC_INDEX["files"].pop(filename)
+    for term in entry["terms"]:
+        postings = DOC_INDEX["postings"][term]
+        del postings[filename]
+        if not postings:
+            del DOC_INDEX["postings"][term]
+
+def add_file(filename, signature):
+    with open(os.path.join(DOCS_PATH, filename), "r", encoding="utf-8") as f:
+        text = f.read()
+
+    tokens = tokenize(text)
+    for pos, (term, start, end) in enumerate(tokens):
+        DOC_INDEX["postings"].setdefault(term, {}).setdefault(filename, []).append(pos)
+
+    DOC_INDEX["files"][filename] = {
+        "signature": signature,
+        "text": text,
+        "spans": [(start, end) for term, start, end in tokens],
+        "terms": set(term for term, start, end in tokens)
+    }
 
-            if any(word.lower() in text.lower() for word in query.split()):
-                return {"filename": filename}
+def refresh_index():
+    now = time.monotonic()
+    if DOC_INDEX["checked_at"] is not None and now - DOC_INDEX["checked_at"] < REFRESH_INTERVAL:
+        return
+    DOC_INDEX["checked_at"] = now
+
+    current = {}
+    for entry in os.scandir(DOCS_PATH):
+        if entry.name.endswith(".txt"):
+            stat = entry.stat()
+            current[entry.name] = (stat.st_mtime, stat.st_size)
+
+    for filename in list(DOC_INDEX["files"]):
+        if current.get(filename) != DOC_INDEX["files"][filename]["signature"]:
+            remove_file(filename)
+
+    for filename, signature in current.items():
+        if filename not in DOC_INDEX["files"]:
+            add_file(filename, signature)
+
+def make_snippets(filename, positions):
+    entry = DOC_INDEX["files"][filename]
+    spans, text = entry["spans"], entry["text"]
+
+    windows = []
+    for pos in sorted(positions):
+        lo, hi = max(pos - SNIPPET_WINDOW, 0), min(pos + SNIPPET_WINDOW, len(spans) - 1)
+        if windows and lo <= windows[-1][1]:
+            windows[-1][1] = hi
+        else:
+            windows.append([lo, hi])
+
+    snippets = []
+    for lo, hi in windows[:SNIPPETS_PER_FILE]:
+        snippet = text[spans[lo][0]:spans[hi][1]].replace("\n", " ")
+        prefix = "..." if lo > 0 else ""
+        suffix = "..." if hi < len(spans) - 1 else ""
+        snippets.append(prefix + snippet + suffix)
+    return snippets
+
+
+# Ranked retrieval function
+
+def search_docs(query, max_results=MAX_RESULTS):
+    refresh_index()
+    n_files = len(DOC_INDEX["files"])
+
+    scores = {}
+    matches = {}
+    for term in set(t for t, start, end in tokenize(query)):
+        postings = DOC_INDEX["postings"].get(term, {})
+        if not postings:
+            continue
+        idf = math.log(1 + n_files / len(postings))
+        for filename, positions in postings.items():
+            scores[filename] = scores.get(filename, 0.0) + (1 + math.log(len(positions))) * idf
+            matches.setdefault(filename, []).extend(positions)
+
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:max_results]
+    results = [
+        {
+            "filename": filename,
+            "score": round(score, 3),
+            "snippets": make_snippets(filename, matches[filename])
+        }
+        for filename, score in ranked
+    ]
 
-    return {"filename": None}
+    return {
+        "filename": results[0]["filename"] if results else None,
+        "results": results
+    }
 
 
 # Tools
 
 def read_document(filename):
-    file_path = os.path.join("./docs", filename)
+    file_path = os.path.join(DOCS_PATH, filename)
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
@@ -71,11 +179,12 @@ tools = [
         "type": "function",
         "function": {
             "name": "search_docs",
-            "description": "Search for relevant documents based on user query.",
+            "description": "Search the documents for a query. Returns files ranked by relevance, each with a score and the matching snippets.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "query": {"type": "string"}
+                    "query": {"type": "string"},
+                    "max_results": {"type": "integer"}
                 },
                 "required": ["query"]
             }
@@ -98,7 +207,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = messages,
         tools = tools
@@ -139,9 +248,10 @@ def run_agent(user_query):
                     "content": json.dumps(result)
                 })
 
-query = "Find documents about oceans and summarize the relevant ones."
+if __name__ == "__main__":
+    query = "Find documents about oceans and summarize the relevant ones."
 
-run_agent(query)
+    run_agent(query)
 
 
 
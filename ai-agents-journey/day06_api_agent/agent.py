@@ -1,10 +1,17 @@
 import os,json, requests
-from groq import Groq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 CITY_COORDS = {
     "delhi": {"lat": 28.6, "lon": 77.2},
@@ -54,7 +61,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = messages,
         tools = tools
@@ -88,8 +95,9 @@ def run_agent(query):
                     "content":json.dumps(result)
                 })
 
-query = "What is the weather in Delhi right now?"
-run_agent(query)
+if __name__ == "__main__":
+    query = "What is the weather in Delhi right now?"
+    run_agent(query)
 
 
 
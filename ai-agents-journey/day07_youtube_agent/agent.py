@@ -8,13 +8,19 @@
 
 
 import os,json,re
-from groq import Groq
 from dotenv import load_dotenv
-from youtube_transcript_api import YouTubeTranscriptApi
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq and youtube_transcript_api are imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 def extract_video_id(url):
     patterns = [
@@ -33,6 +39,7 @@ def get_youtube_transcript(url):
         return "Invalid Youtube URL."
 
     try:
+        from youtube_transcript_api import YouTubeTranscriptApi
         transcript = YouTubeTranscriptApi.get_transcript(video_id)
         full_text = " ".join([item["text"] for item in transcript])
         return full_text
@@ -61,7 +68,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages = messages,
         tools = tools
@@ -96,9 +103,10 @@ def run_agent(query):
                 )
 
 
-query = "Summarize this YouTube video: https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+if __name__ == "__main__":
+    query = "Summarize this YouTube video: https://www.youtube.com/watch?v=dQw4w9WgXcQ"
 
-run_agent(query)
+    run_agent(query)
 
 
 # Expected Output:
@@ -1,12 +1,19 @@
 # Messy text and extract clean structured JSON
 
 import os,json
-from groq import Groq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 def save_json(**data):
     return {
@@ -40,7 +47,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools = tools
@@ -74,7 +81,8 @@ def run_agent(query):
                     "content": json.dumps(result)
                 })
 
-query = """
+if __name__ == "__main__":
+    query = """
 Hey, can you help me record this customer detail?
 
 So yesterday a guy named Rohit Sharma (32 years old, from Mumbai)
@@ -85,7 +93,7 @@ Thanks.
 
 """
 
-run_agent(query)
+    run_agent(query)
 
 
 # Expected Output:
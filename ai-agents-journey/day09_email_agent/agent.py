@@ -6,12 +6,19 @@
 # Use tool-calling to generate the final draft
 
 import os,json
-from groq import Groq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 def write_email(subject: str, message_body:str, tone: str="formal"):
     if tone =="formal":
@@ -73,7 +80,7 @@ SYSTEM_MSG = {
 }
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages = messages,
         tools=tools
@@ -107,12 +114,13 @@ def run_agent(query):
                     "content": json.dumps(result)
                 })
 
-query = """
+if __name__ == "__main__":
+    query = """
 My name is Shah rukh khan . write an email to my manager explaining that I need leave tomorrow because I have a medical appointment.
 Tone should be semi-formal.
 """
 
-run_agent(query)
+    run_agent(query)
 
 
 # Expected Output:
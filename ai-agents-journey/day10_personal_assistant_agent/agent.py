@@ -9,13 +9,20 @@
 
 
 import os,json
-from groq import Groq
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# groq is imported on first use to keep startup fast
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 CITY_COORDS = {
     "delhi": {"lat": 28.6, "lon": 77.2},
@@ -112,7 +119,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
@@ -146,8 +153,9 @@ def run_agent(query):
                     "content": json.dumps(result)
                 })
  
-query = "Add a task to buy groceries and then tell me the current time."
-run_agent(query)
+if __name__ == "__main__":
+    query = "Add a task to buy groceries and then tell me the current time."
+    run_agent(query)
 
 
 # Expected Output:
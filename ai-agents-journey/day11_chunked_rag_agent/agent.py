@@ -8,18 +8,31 @@
 # Generate an answer grounded in evidence
 
 import os,json
-from groq import Groq
+from array import array
+from collections import OrderedDict
 from dotenv import load_dotenv
 from datetime import datetime
+import numpy as np
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+# created on first use, so the retriever can be imported without an API key
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from groq import Groq
+        client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
 
 DOCS_PATH = "./docs"
 
 CHUNK_SIZE = 120
 
+# weight matches by tf-idf instead of counting matched query words
+TFIDF_WEIGHTING = False
+
 # chunk logic
 def chunk_text(text, size=CHUNK_SIZE):
     words = text.split()
@@ -35,30 +48,239 @@ def load_documents():
         if filename.endswith(".txt"):
             with open(os.path.join(DOCS_PATH, filename), "r", encoding = "utf-8") as f:
                 text = f.read()
-            for chunk in chunk_text(text):
+            for i, chunk in enumerate(chunk_text(text)):
                 chunks.append({
                     "file": filename,
-                    "content": chunk
+                    "content": chunk,
+                    "chunk": i
                 })
     return chunks
 
 DOCUMENT_CHUNKS = load_documents()
 
-# simple relevance scoring
-def score_chunk(chunk, query):
-    score = 0
-    for word in query.lower().split():
-        if word in chunk.lower():
-            score +=1
-    return score
-
-def retrieve_chunks(query, top_k=3):
-    scored = [
-        (score_chunk(c["content"], query), c)
-        for c in DOCUMENT_CHUNKS
-    ]
-    scored.sort(key=lambda x:x[0], reverse=True)
-    return [c for score, c in scored if score > 0][:top_k]
+TERM_MATRIX = None
+MATCH_CACHE_SIZE = 10000
+
+# Term-chunk matrix: one CSR row per distinct (lowercased, whitespace-split)
+# token, one column per chunk, values are term frequencies. Row-major by term
+# means a query only touches the rows of the terms it matches.
+# A query word "matches" a chunk when it is a substring of one of the chunk's
+# tokens, which is exactly the old `word in chunk.lower()` test.
+def build_term_matrix(chunks):
+    from scipy.sparse import csr_matrix
+
+    vocab = {}
+    cols = array("i")
+    indptr = array("q", [0])
+    for chunk in chunks:
+        cols.extend(vocab.setdefault(t, len(vocab)) for t in chunk["content"].lower().split())
+        indptr.append(len(cols))
+
+    index_dtype = np.int32 if len(cols) < 2**31 else np.int64
+    tf = csr_matrix(
+        (
+            np.ones(len(cols), dtype=np.float32),
+            np.frombuffer(cols, dtype=np.int32).astype(index_dtype, copy=False),
+            np.frombuffer(indptr, dtype=np.int64).astype(index_dtype)
+        ),
+        shape = (len(chunks), len(vocab))
+    )
+    tf.sum_duplicates()
+    del cols
+
+    term_chunk = tf.T.tocsr()
+    del tf
+
+    df = np.diff(term_chunk.indptr)
+    idf = (np.log((1 + len(chunks)) / (1 + df)) + 1).astype(np.float32)
+
+    # both matrices share the index arrays; only the values differ
+    presence = csr_matrix(
+        (np.ones(term_chunk.nnz, dtype=np.float32), term_chunk.indices, term_chunk.indptr),
+        shape = term_chunk.shape
+    )
+    term_chunk.data *= np.repeat(idf, df)
+
+    # all terms in one string, so finding the terms that contain a query word
+    # is a C-level str.find scan over the vocabulary instead of the chunks
+    terms = list(vocab)
+    offsets = np.cumsum([0] + [len(t) + 1 for t in terms])
+
+    return {
+        "presence": presence,
+        "tfidf": term_chunk,
+        "terms_blob": "\n".join(terms),
+        "offsets": offsets,
+        "matches": OrderedDict()
+    }
+
+def get_term_matrix():
+    global TERM_MATRIX
+    if TERM_MATRIX is None:
+        TERM_MATRIX = build_term_matrix(DOCUMENT_CHUNKS)
+    return TERM_MATRIX
+
+def matching_terms(matrix, word):
+    # memoized per query word, least recently used evicted past MATCH_CACHE_SIZE
+    matches = matrix["matches"]
+    if word in matches:
+        matches.move_to_end(word)
+    else:
+        blob, offsets = matrix["terms_blob"], matrix["offsets"]
+        found = []
+        pos = blob.find(word)
+        while pos != -1:
+            term_id = int(np.searchsorted(offsets, pos, side="right")) - 1
+            found.append(term_id)
+            pos = blob.find(word, offsets[term_id + 1])
+        matches[word] = found
+        while len(matches) > MATCH_CACHE_SIZE:
+            matches.popitem(last=False)
+    return matches[word]
+
+def score_chunks(query, matrix, tfidf=TFIDF_WEIGHTING):
+    from scipy.sparse import csr_matrix
+
+    words = query.lower().split()
+    distinct = list(dict.fromkeys(words))
+    multiplicity = np.array([words.count(w) for w in distinct], dtype=np.float32)
+
+    rows, cols = [], []
+    for j, word in enumerate(distinct):
+        for term_id in matching_terms(matrix, word):
+            rows.append(j)
+            cols.append(term_id)
+
+    n_terms, n_chunks = matrix["presence"].shape
+    query_terms = csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape = (len(distinct), n_terms)
+    )
+
+    # query-words x chunks in one sparse product
+    if tfidf:
+        hits = query_terms @ matrix["tfidf"]
+        return np.asarray(multiplicity @ hits).ravel()
+
+    hits = query_terms @ matrix["presence"]
+    hits.data = (hits.data > 0).astype(np.float32)
+    return np.asarray(multiplicity @ hits).ravel()
+
+def top_k_ids(scores, top_k):
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > top_k:
+        candidate_scores = scores[candidates]
+        kth = candidate_scores[np.argpartition(candidate_scores, -top_k)[-top_k]]
+        above = candidates[candidate_scores > kth]
+        # ties at the cut-off keep corpus order, like the old stable sort
+        ties = candidates[candidate_scores == kth][:top_k - len(above)]
+        candidates = np.concatenate([above, ties])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+def retrieve_chunks(query, top_k=3, tfidf=TFIDF_WEIGHTING):
+    scores = score_chunks(query, get_term_matrix(), tfidf)
+    return [DOCUMENT_CHUNKS[i] for i in top_k_ids(scores, top_k)]
+
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
 
 TOOLS_FUNCTION = {
     "retrieve_chunks": retrieve_chunks
@@ -86,7 +308,7 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
@@ -113,10 +335,8 @@ def run_agent(query):
 
                 print("Result: ",result)
 
-                context = "\n\n".join(
-                    f"[{r['file']}]\n{r['content']}"
-                    for r in result
-                )
+                context, pack_stats = pack_context(result)
+                print("Context tokens:", pack_stats)
 
                 messages.append({"role":"assistant", "tool_calls": msg.tool_calls})
                 messages.append({
@@ -126,8 +346,9 @@ def run_agent(query):
                 })
 
 
-query = "What are the major threats to ocean health?"
-run_agent(query)
+if __name__ == "__main__":
+    query = "What are the major threats to ocean health?"
+    run_agent(query)
 
 
 
@@ -0,0 +1,126 @@
+# Benchmark: linear keyword scan vs sparse term-chunk matrix (agent.py)
+#
+# Generates a synthetic corpus of CHUNK_SIZE-word chunks with a Zipf-like
+# vocabulary, then compares per-query latency of
+#   - the old retrieval: score_chunk() on every chunk, then sort
+#   - the new retrieval: one sparse product + argpartition top-k
+#
+# The linear scan is far too slow to run on 1M chunks for every query, so it
+# is timed on a sample of the corpus and scaled up linearly (it is O(chunks)).
+#
+# Usage:
+#   python benchmark.py                       # 1,000,000 chunks
+#   python benchmark.py --chunks 100000 --queries 50
+
+import os,sys,time,random
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+from agent import CHUNK_SIZE, build_term_matrix, score_chunks, top_k_ids
+
+N_CHUNKS = 1_000_000
+N_QUERIES = 100
+VOCAB_SIZE = 50_000
+BASELINE_SAMPLE = 20_000
+TOP_K = 3
+
+def make_vocab(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocab = set()
+    while len(vocab) < size:
+        vocab.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(vocab)
+
+def make_corpus(n_chunks, vocab, seed=0):
+    np_rng = np.random.default_rng(seed)
+    # Zipf-like word frequencies, like natural text
+    weights = 1 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    vocab = np.array(vocab, dtype=object)
+
+    chunks = []
+    for start in range(0, n_chunks, 10_000):
+        n = min(10_000, n_chunks - start)
+        words = vocab[np_rng.choice(len(vocab), size=(n, CHUNK_SIZE), p=weights)]
+        chunks.extend({"file": f"doc{start + i}.txt", "content": " ".join(row)} for i, row in enumerate(words))
+    return chunks
+
+def make_queries(chunks, vocab, n_queries, rng):
+    queries = []
+    for _ in range(n_queries):
+        words = rng.choice(chunks)["content"].split()
+        queries.append(" ".join(rng.sample(words, 3) + [rng.choice(vocab)]))
+    return queries
+
+# the retrieval from before the term matrix
+def score_chunk(chunk, query):
+    score = 0
+    for word in query.lower().split():
+        if word in chunk.lower():
+            score +=1
+    return score
+
+def linear_retrieve(chunks, query, top_k=TOP_K):
+    scored = [(score_chunk(c["content"], query), i) for i, c in enumerate(chunks)]
+    scored.sort(key=lambda x:x[0], reverse=True)
+    return [i for score, i in scored if score > 0][:top_k]
+
+def matrix_retrieve(matrix, query, top_k=TOP_K, tfidf=False):
+    return [int(i) for i in top_k_ids(score_chunks(query, matrix, tfidf), top_k)]
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return f"p50 {p50:8.2f} ms   p95 {p95:8.2f} ms   p99 {p99:8.2f} ms"
+
+def timed(fn, queries):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main(argv):
+    n_chunks, n_queries = N_CHUNKS, N_QUERIES
+    if "--chunks" in argv:
+        n_chunks = int(argv[argv.index("--chunks") + 1])
+    if "--queries" in argv:
+        n_queries = int(argv[argv.index("--queries") + 1])
+
+    rng = random.Random(0)
+    vocab = make_vocab(VOCAB_SIZE, rng)
+
+    start = time.perf_counter()
+    chunks = make_corpus(n_chunks, vocab)
+    print(f"corpus: {len(chunks):,} chunks x {CHUNK_SIZE} words ({time.perf_counter() - start:.1f}s to generate)")
+    queries = make_queries(chunks, vocab, n_queries, rng)
+
+    start = time.perf_counter()
+    matrix = build_term_matrix(chunks)
+    build_time = time.perf_counter() - start
+    presence = matrix["presence"]
+    print(f"term matrix: {presence.shape[0]:,} terms, {presence.nnz:,} non-zeros, built in {build_time:.1f}s")
+
+    # same answers as the linear scan (checked on the sample)
+    sample = chunks[:min(BASELINE_SAMPLE, len(chunks))]
+    sample_matrix = build_term_matrix(sample)
+    for q in queries[:20]:
+        assert linear_retrieve(sample, q) == matrix_retrieve(sample_matrix, q), q
+
+    baseline = timed(lambda q: linear_retrieve(sample, q), queries[:max(5, n_queries // 10)])
+    scale = len(chunks) / len(sample)
+    baseline_mean = np.mean(baseline) * scale
+
+    matrix_lat = timed(lambda q: matrix_retrieve(matrix, q), queries)
+    tfidf_lat = timed(lambda q: matrix_retrieve(matrix, q, tfidf=True), queries)
+
+    print(f"\nlinear scan   mean {baseline_mean * 1000:10.2f} ms"
+          + (f"   (measured on {len(sample):,} chunks, x{scale:.0f})" if scale > 1 else ""))
+    print(f"term matrix   mean {np.mean(matrix_lat) * 1000:10.2f} ms   {percentiles(matrix_lat)}")
+    print(f"  + tf-idf    mean {np.mean(tfidf_lat) * 1000:10.2f} ms   {percentiles(tfidf_lat)}")
+    print(f"\nspeedup: {baseline_mean / np.mean(matrix_lat):.0f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,17 +1,41 @@
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import os,json
+import os,sys,json,threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
 DOCS_PATH = "./docs"
 CHUNK_SIZE = 120
 
-embedder = SentenceTransformer("all-MiniLm-L6-v2")
+# Heavy dependencies (groq, sentence_transformers, sklearn) are loaded on first
+# use, so importing this module to reuse chunk_text / retrieve_chunks is cheap.
+# Call warmup() to pay the cost up front, optionally in the background.
+client = None
+embedder = None
+DOCUMENT_CHUNKS = []
+CHUNK_EMBEDDINGS = None
+
+_init_lock = threading.RLock()
+
+def get_client():
+    global client
+    with _init_lock:
+        if client is None:
+            from groq import Groq
+            client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+def get_embedder():
+    global embedder
+    with _init_lock:
+        if embedder is None and os.getenv("EMBEDDING_SERVER_URL"):
+            # share one batched model per machine (day19_embedding_server)
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "day19_embedding_server"))
+            from embedding_client import EmbeddingClient
+            embedder = EmbeddingClient(os.getenv("EMBEDDING_SERVER_URL"))
+        elif embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer("all-MiniLm-L6-v2")
+    return embedder
 
 def chunk_text(text):
     words = text.split()
@@ -29,23 +53,45 @@ def load_and_embed():
             with open(os.path.join(DOCS_PATH,file), "r", encoding="utf-8") as f:
                 text = f.read()
 
-            for chunk in chunk_text(text):
+            for i, chunk in enumerate(chunk_text(text)):
                 chunks.append({
                     "file": file,
-                    "content": chunk
+                    "content": chunk,
+                    "chunk": i
                 })
-                embeddings.append(embedder.encode(chunk))
+                embeddings.append(get_embedder().encode(chunk))
 
     return chunks, embeddings
 
-DOCUMENT_CHUNKS, CHUNK_EMBEDDINGS = load_and_embed()
+def get_documents():
+    global DOCUMENT_CHUNKS, CHUNK_EMBEDDINGS
+    with _init_lock:
+        if CHUNK_EMBEDDINGS is None:
+            DOCUMENT_CHUNKS, CHUNK_EMBEDDINGS = load_and_embed()
+    return DOCUMENT_CHUNKS, CHUNK_EMBEDDINGS
+
+def warmup(background=True):
+    def load_all():
+        get_client()
+        get_documents()
+
+    if not background:
+        load_all()
+        return None
+
+    thread = threading.Thread(target=load_all, name="warmup", daemon=True)
+    thread.start()
+    return thread
 
 def retrieve_chunks(query, top_k=3):
-    query_embedding = embedder.encode(query)
-    scores = cosine_similarity([query_embedding], CHUNK_EMBEDDINGS)[0]
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    chunks, chunk_embeddings = get_documents()
+    query_embedding = get_embedder().encode(query)
+    scores = cosine_similarity([query_embedding], chunk_embeddings)[0]
 
     ranked = sorted(
-        zip(scores, DOCUMENT_CHUNKS),
+        zip(scores, chunks),
         key = lambda x: x[0],
         reverse = True
     )
@@ -53,6 +99,106 @@ def retrieve_chunks(query, top_k=3):
     return [chunk for score, chunk in ranked[:top_k]]
 
 
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
+
 TOOLS_FUNCTION = {
     "retrieve_chunks": retrieve_chunks
 }
@@ -76,7 +222,7 @@ tools = [
 ]
 
 def call_models(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
@@ -99,10 +245,8 @@ def run_agent(query):
                 args = json.loads(call.function.arguments)
                 results = retrieve_chunks(**args)
 
-                context = "\n\n".join(
-                    f"[{r['file']}]\n{r['content']}"
-                    for r in results
-                )
+                context, pack_stats = pack_context(results)
+                print("Context tokens:", pack_stats)
 
                 messages.append({"role": "assistant", "tool_calls":msg.tool_calls})
                 messages.append({
@@ -112,8 +256,10 @@ def run_agent(query):
                 })
 
 
-query = "Why are oceans important for climate regulation?"
-run_agent(query)
+if __name__ == "__main__":
+    warmup()
+    query = "Why are oceans important for climate regulation?"
+    run_agent(query)
 
 
 #  Expected Output :
@@ -0,0 +1,112 @@
+# Benchmark: flat FAISS search vs two-level (file routing -> per-file) search
+#
+# Generates clustered unit vectors shaped like an embedded corpus: files are
+# grouped into topics (FILES_PER_TOPIC files around one topic direction) and
+# every chunk is a noisy copy of its file's direction, so neighbouring files
+# overlap. Queries are perturbed chunks. For each ROUTE_TOP_FILES setting we report
+#   - query latency of search_chunks() with and without the hierarchy
+#   - recall@k of the hierarchical results against the exact flat results
+#
+# No model is loaded; vectors stand in for MiniLM embeddings (384 dims).
+#
+# Usage:
+#   python benchmark.py                                   # 200,000 chunks in 2,000 files
+#   python benchmark.py --chunks 1000000 --files 10000 --queries 200
+#   python benchmark.py --route 1,2,4,8,16
+
+import os,sys,time
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+import agent
+
+N_CHUNKS = 200_000
+N_FILES = 2_000
+N_QUERIES = 200
+DIM = 384
+TOP_K = 5
+ROUTES = [1, 2, 4, 8, 16]
+FILES_PER_TOPIC = 10
+FILE_NOISE = 0.5
+CHUNK_NOISE = 1.5
+QUERY_NOISE = 1.0
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_corpus(n_chunks, n_files, rng):
+    n_topics = max(n_files // FILES_PER_TOPIC, 1)
+    topics = normalize(rng.standard_normal((n_topics, DIM)).astype("float32"))
+    spread = rng.standard_normal((n_files, DIM)).astype("float32") * FILE_NOISE / np.sqrt(DIM)
+    centers = normalize(topics[np.arange(n_files) % n_topics] + spread)
+    file_of = np.sort(rng.integers(0, n_files, n_chunks))
+
+    vectors = np.empty((n_chunks, DIM), dtype="float32")
+    for start in range(0, n_chunks, 100_000):
+        end = min(start + 100_000, n_chunks)
+        noise = rng.standard_normal((end - start, DIM)).astype("float32") * CHUNK_NOISE / np.sqrt(DIM)
+        vectors[start:end] = normalize(centers[file_of[start:end]] + noise)
+
+    chunks = [{"file": f"doc{f}.txt", "content": ""} for f in file_of]
+    return chunks, vectors
+
+def make_queries(vectors, n_queries, rng):
+    picked = vectors[rng.integers(0, len(vectors), n_queries)]
+    noise = rng.standard_normal(picked.shape).astype("float32") * QUERY_NOISE / np.sqrt(DIM)
+    return normalize(picked + noise).astype("float32")
+
+def run(queries, hierarchical):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        distances, ids = agent.search_chunks(q[None, :], TOP_K, hierarchical=hierarchical)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(ids[0].tolist()) - {-1})
+    return latencies, results
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return f"p50 {p50:8.2f} ms   p95 {p95:8.2f} ms   p99 {p99:8.2f} ms"
+
+def main(argv):
+    import faiss
+
+    n_chunks, n_files, n_queries, routes = N_CHUNKS, N_FILES, N_QUERIES, ROUTES
+    if "--chunks" in argv:
+        n_chunks = int(argv[argv.index("--chunks") + 1])
+    if "--files" in argv:
+        n_files = int(argv[argv.index("--files") + 1])
+    if "--queries" in argv:
+        n_queries = int(argv[argv.index("--queries") + 1])
+    if "--route" in argv:
+        routes = [int(m) for m in argv[argv.index("--route") + 1].split(",")]
+
+    rng = np.random.default_rng(0)
+    chunks, vectors = make_corpus(n_chunks, n_files, rng)
+    queries = make_queries(vectors, n_queries, rng)
+    print(f"corpus: {n_chunks:,} chunks in {n_files:,} files, {DIM} dims, {n_queries} queries, k={TOP_K}")
+
+    start = time.perf_counter()
+    agent.index = faiss.IndexFlatL2(DIM)
+    agent.index.add(vectors)
+    agent.DOCUMENT_CHUNKS = chunks
+    print(f"flat index built in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    agent.file_index = agent.build_file_index(chunks, agent.index)
+    print(f"file index built in {time.perf_counter() - start:.2f}s")
+
+    flat_lat, exact = run(queries, hierarchical=False)
+    print(f"\nflat                    {percentiles(flat_lat)}")
+
+    for m in routes:
+        agent.ROUTE_TOP_FILES = m
+        tree_lat, found = run(queries, hierarchical=True)
+        recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+        speedup = np.mean(flat_lat) / np.mean(tree_lat)
+        print(f"route {m:<4} recall {recall:.3f}   {percentiles(tree_lat)}   {speedup:6.1f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,19 +1,112 @@
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-import faiss
-import os,json
+import os,sys,hashlib,re,json,math,time,heapq,base64,threading
+from collections import OrderedDict
+import concurrent.futures
 from dotenv import load_dotenv
 import numpy as np
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
 DOCS_PATH = "./docs"
 CHUNK_SIZE = 120
 TOP_K = 3
 
-embedder = SentenceTransformer("all-MiniLm-L6-v2")
+# FAISS + BM25 indexes are persisted here and rebuilt when the docs change
+INDEX_PATH = "./index"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Hybrid fusion of the vector and keyword rankings:
+#   "rrf"   - reciprocal rank fusion, sum of weight / (RRF_K + rank)
+#   "score" - weighted sum of min-max normalized scores
+# RRF has its own, equal weights: with RRF_K = 60 rank differences are small,
+# so a 0.7/0.3 split lets every vector hit outscore the best keyword-only hit
+# and rare-term matches the dense leg missed never reach the top_k. Raising
+# RRF_VECTOR_WEIGHT trades that recall for a more semantic ranking.
+FUSION = "rrf"
+RRF_K = 60
+RRF_VECTOR_WEIGHT = 1.0
+RRF_KEYWORD_WEIGHT = 1.0
+VECTOR_WEIGHT = 0.7
+KEYWORD_WEIGHT = 0.3
+
+# MMR diversification: over-fetch MMR_FETCH_FACTOR * top_k candidates and pick a
+# top_k that trades relevance (lambda = 1) against redundancy (lambda = 0)
+MMR_ENABLED = False
+MMR_LAMBDA = 0.5
+MMR_FETCH_FACTOR = 4
+
+# Cross-encoder re-ranking of the first-stage hits. Scoring is cached per
+# (query, chunk) and must finish within RERANK_BUDGET_MS, otherwise the
+# first-stage order is kept.
+RERANK_ENABLED = False
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 10
+RERANK_BUDGET_MS = 300
+RERANK_CACHE_SIZE = 10000
+
+# Adaptive top_k: look at the ADAPTIVE_FETCH_K nearest chunks and return only the
+# ones with cosine similarity >= ADAPTIVE_MIN_SIMILARITY that are within
+# ADAPTIVE_MAX_DROP (relative) of the best hit; at least ADAPTIVE_MIN_K, at most
+# ADAPTIVE_MAX_K and never more than the requested top_k
+ADAPTIVE_TOP_K = True
+ADAPTIVE_MIN_K = 1
+ADAPTIVE_MAX_K = 8
+ADAPTIVE_FETCH_K = 10
+ADAPTIVE_MIN_SIMILARITY = 0.3
+ADAPTIVE_MAX_DROP = 0.3
+
+# Two-level retrieval: route the query to the ROUTE_TOP_FILES files whose
+# centroid (mean of their chunk vectors) is closest, then search only those
+# files' chunk indexes. Search cost grows with files routed, not corpus size.
+# Trade-off: the per-file shards hold a second copy of every chunk vector next
+# to the flat index (kept for MMR and the flat fallback), so vector memory
+# doubles while this is on.
+HIERARCHICAL_ENABLED = False
+ROUTE_TOP_FILES = 8
+
+# Pre-retrieval: retrieve for the user's question before the first model call
+# and put the context in the prompt, saving the round trip in which the model
+# would only ask for it. retrieve_chunks stays available as a tool in case the
+# model wants more. False restores the tool-driven flow.
+PRE_RETRIEVAL = True
+
+# Heavy dependencies (groq, sentence_transformers, faiss) are loaded on first
+# use, so importing this module to reuse chunk_text / retrieve_chunks is cheap.
+# Call warmup() to pay the cost up front, optionally in the background.
+client = None
+embedder = None
+index = None
+bm25_index = None
+DOCUMENT_CHUNKS = []
+file_index = None
+
+reranker = None
+_rerank_cache = OrderedDict()
+_rerank_cache_lock = threading.Lock()
+_rerank_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+_init_lock = threading.RLock()
+
+def get_client():
+    global client
+    with _init_lock:
+        if client is None:
+            from groq import Groq
+            client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+def get_embedder():
+    global embedder
+    with _init_lock:
+        if embedder is None and os.getenv("EMBEDDING_SERVER_URL"):
+            # share one batched model per machine (day19_embedding_server)
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "day19_embedding_server"))
+            from embedding_client import EmbeddingClient
+            embedder = EmbeddingClient(os.getenv("EMBEDDING_SERVER_URL"))
+        elif embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer("all-MiniLm-L6-v2")
+    return embedder
 
 def chunk_text(text):
     word = text.split()
@@ -24,51 +117,617 @@ def chunk_text(text):
 
 def load_documents():
     chunks = []
-    for file in os.listdir(DOCS_PATH):
+    # sorted so chunk ids line up with the persisted indexes
+    for file in sorted(os.listdir(DOCS_PATH)):
         if file.endswith(".txt"):
             with open(os.path.join(DOCS_PATH, file), "r", encoding = "utf-8") as f:
                 text = f.read()
-            for chunk in chunk_text(text):
+            for i, chunk in enumerate(chunk_text(text)):
                 chunks.append({
                     "file":file,
-                    "content": chunk
+                    "content": chunk,
+                    "chunk": i
                 })
     return chunks
 
-DOCUMENT_CHUNKS = load_documents() 
+# BM25 inverted index: term -> postings list of [chunk_id, term frequency]
+# plus a positional index: term -> varint bytes of
+#   (chunk_id gap, n positions, position gaps...) per chunk, in chunk order
+# used for "exact phrase" and  word NEAR/k word  queries.
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+def encode_varints(numbers):
+    out = bytearray()
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+def decode_varints(data):
+    numbers, n, shift = [], 0, 0
+    for byte in data:
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(n)
+            n, shift = 0, 0
+    return numbers
+
+def encode_positions(entries):
+    numbers = []
+    prev_chunk = 0
+    for chunk_id, positions in entries:
+        numbers += [chunk_id - prev_chunk, len(positions)]
+        prev_pos = 0
+        for pos in positions:
+            numbers.append(pos - prev_pos)
+            prev_pos = pos
+        prev_chunk = chunk_id
+    return encode_varints(numbers)
+
+def decode_positions(data):
+    numbers = decode_varints(data)
+    postings = {}
+    i, chunk_id = 0, 0
+    while i < len(numbers):
+        chunk_id += numbers[i]
+        count = numbers[i + 1]
+        positions, pos = [], 0
+        for gap in numbers[i + 2:i + 2 + count]:
+            pos += gap
+            positions.append(pos)
+        postings[chunk_id] = positions
+        i += 2 + count
+    return postings
+
+def build_bm25(chunks):
+    postings = {}
+    positions = {}
+    doc_len = []
+    for chunk_id, chunk in enumerate(chunks):
+        tokens = tokenize(chunk["content"])
+        doc_len.append(len(tokens))
+
+        term_positions = {}
+        for pos, term in enumerate(tokens):
+            term_positions.setdefault(term, []).append(pos)
+        for term, term_pos in term_positions.items():
+            postings.setdefault(term, []).append([chunk_id, len(term_pos)])
+            positions.setdefault(term, []).append((chunk_id, term_pos))
+
+    return {
+        "postings": postings,
+        "positions": {term: encode_positions(entries) for term, entries in positions.items()},
+        "doc_len": doc_len,
+        "avg_len": sum(doc_len) / max(len(doc_len), 1),
+        "n_docs": len(chunks)
+    }
+
+def bm25_search(query, top_k, restrict=None):
+    # only the postings of the query terms are touched, not every chunk
+    keyword_index = get_bm25_index()
+    n_docs = keyword_index["n_docs"]
+    doc_len = keyword_index["doc_len"]
+    avg_len = keyword_index["avg_len"] or 1
+
+    scores = {}
+    for term in set(tokenize(query)):
+        postings = keyword_index["postings"].get(term)
+        if not postings:
+            continue
+        df = len(postings)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for chunk_id, tf in postings:
+            if restrict is not None and chunk_id not in restrict:
+                continue
+            norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len[chunk_id] / avg_len))
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm
+
+    return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+
+# Positional queries
+
+PHRASE_RE = re.compile(r'"([^"]+)"')
+NEAR_RE = re.compile(r"(\w+)\s+NEAR/(\d+)\s+(\w+)")
+
+def strip_operators(query):
+    return NEAR_RE.sub(r"\1 \3", query).replace('"', " ")
+
+def term_positions(term):
+    data = get_bm25_index()["positions"].get(term)
+    return decode_positions(data) if data else {}
+
+def phrase_match(terms):
+    postings = [term_positions(t) for t in terms]
+    if not all(postings):
+        return set()
+
+    matches = set()
+    for chunk_id in set.intersection(*(set(p) for p in postings)):
+        # phrase start positions that line up across every term
+        starts = set(postings[0][chunk_id])
+        for offset, term_postings in enumerate(postings[1:], start=1):
+            starts &= {pos - offset for pos in term_postings[chunk_id]}
+            if not starts:
+                break
+        if starts:
+            matches.add(chunk_id)
+    return matches
+
+def near_match(first, second, distance):
+    first_postings, second_postings = term_positions(first), term_positions(second)
+
+    matches = set()
+    for chunk_id in first_postings.keys() & second_postings.keys():
+        xs, ys = first_postings[chunk_id], second_postings[chunk_id]
+        i = j = 0
+        while i < len(xs) and j < len(ys):
+            if abs(xs[i] - ys[j]) <= distance:
+                matches.add(chunk_id)
+                break
+            if xs[i] < ys[j]:
+                i += 1
+            else:
+                j += 1
+    return matches
+
+def positional_match(query):
+    # chunk ids matching every phrase / NEAR clause, or None if there are none
+    matched = None
+    for phrase in PHRASE_RE.findall(query):
+        terms = tokenize(phrase)
+        if terms:
+            hits = phrase_match(terms)
+            matched = hits if matched is None else matched & hits
+    for first, distance, second in NEAR_RE.findall(query):
+        hits = near_match(first.lower(), second.lower(), int(distance))
+        matched = hits if matched is None else matched & hits
+    return matched
+
+def keyword_search(query, top_k):
+    matched = positional_match(query)
+    if matched is not None and not matched:
+        # a phrase / NEAR clause nothing satisfies: no keyword hits either
+        return matched, []
+    hits = bm25_search(strip_operators(query), top_k, restrict=matched)
+    return matched, hits
+
+def build_index(chunks):
+    import faiss
+
+    embeddings = get_embedder().encode(
+        [c["content"] for c in chunks],
+        convert_to_numpy = True
+    )
+
+    dimension = embeddings.shape[1]
+    new_index = faiss.IndexFlatL2(dimension)
+    new_index.add(embeddings)
+    return new_index
+
+def docs_signature():
+    files = sorted(f for f in os.listdir(DOCS_PATH) if f.endswith(".txt"))
+    return {
+        "format": 2,
+        "model": "all-MiniLm-L6-v2",
+        "chunk_size": CHUNK_SIZE,
+        "files": [
+            [f, os.path.getmtime(os.path.join(DOCS_PATH, f)), os.path.getsize(os.path.join(DOCS_PATH, f))]
+            for f in files
+        ]
+    }
+
+def load_or_build_indexes(chunks):
+    import faiss
+
+    faiss_path = os.path.join(INDEX_PATH, "faiss.index")
+    bm25_path = os.path.join(INDEX_PATH, "bm25.json")
+    meta_path = os.path.join(INDEX_PATH, "meta.json")
+    signature = docs_signature()
+
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta == signature:
+            with open(bm25_path, "r", encoding="utf-8") as f:
+                keyword_index = json.load(f)
+            keyword_index["positions"] = {
+                term: base64.b64decode(data) for term, data in keyword_index["positions"].items()
+            }
+            return faiss.read_index(faiss_path), keyword_index
+
+    vector_index = build_index(chunks)
+    keyword_index = build_bm25(chunks)
+
+    os.makedirs(INDEX_PATH, exist_ok=True)
+    faiss.write_index(vector_index, faiss_path)
+    with open(bm25_path, "w", encoding="utf-8") as f:
+        positions = {
+            term: base64.b64encode(data).decode("ascii") for term, data in keyword_index["positions"].items()
+        }
+        json.dump(dict(keyword_index, positions=positions), f)
+    # written last, so an interrupted save is rebuilt next time
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(signature, f)
+
+    return vector_index, keyword_index
+
+def get_index():
+    global index, bm25_index, DOCUMENT_CHUNKS
+    with _init_lock:
+        if index is None:
+            DOCUMENT_CHUNKS = load_documents()
+            index, bm25_index = load_or_build_indexes(DOCUMENT_CHUNKS)
+    return index
+
+def get_bm25_index():
+    get_index()
+    return bm25_index
+
+def build_file_index(chunks, chunk_index):
+    import faiss
+
+    # reuse the stored chunk vectors instead of re-encoding, one file at a time
+    # so there is never a third full copy of them
+    by_file = {}
+    for i, chunk in enumerate(chunks):
+        by_file.setdefault(chunk["file"], []).append(i)
 
-def keyword_score(text, query):
-    score = 0
-    for word in query.lower().split():
-        score +=text.lower().count(word)
-    return score
+    files, shards, centroids = [], [], []
+    for file, ids in by_file.items():
+        ids = np.array(ids, dtype="int64")
+        vectors = chunk_index.reconstruct_batch(ids)
+        shard = faiss.IndexFlatL2(vectors.shape[1])
+        shard.add(vectors)
+        files.append(file)
+        shards.append((shard, ids))
+        centroids.append(vectors.mean(axis=0))
 
-embeddings = embedder.encode(
-    [c["content"] for c in DOCUMENT_CHUNKS],
-    convert_to_numpy=True
-)
+    # unit-length centroids, so routing ranks files by cosine similarity
+    centroids = np.array(centroids, dtype="float32")
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    router = faiss.IndexFlatL2(centroids.shape[1])
+    router.add(centroids)
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
+    return {"router": router, "files": files, "shards": shards}
+
+def get_file_index():
+    global file_index
+    with _init_lock:
+        if file_index is None:
+            chunk_index = get_index()
+            file_index = build_file_index(DOCUMENT_CHUNKS, chunk_index)
+    return file_index
+
+def search_chunks(query_vec, k, hierarchical=None):
+    # same (distances, indices) shape as index.search, padded with -1;
+    # the flag is read at call time, like warmup() does
+    if hierarchical is None:
+        hierarchical = HIERARCHICAL_ENABLED
+    if not hierarchical:
+        return get_index().search(query_vec, k)
+
+    tree = get_file_index()
+    _, routed = tree["router"].search(query_vec, min(ROUTE_TOP_FILES, len(tree["shards"])))
+
+    distances, ids = [], []
+    for f in routed[0]:
+        if f == -1:
+            continue
+        shard, shard_ids = tree["shards"][f]
+        d, i = shard.search(query_vec, min(k, shard.ntotal))
+        distances.extend(d[0])
+        ids.extend(shard_ids[i[0]])
+
+    order = np.argsort(distances, kind="stable")[:k]
+    out_distances = np.full((1, k), np.finfo("float32").max, dtype="float32")
+    out_ids = np.full((1, k), -1, dtype="int64")
+    out_distances[0, :len(order)] = np.array(distances, dtype="float32")[order]
+    out_ids[0, :len(order)] = np.array(ids, dtype="int64")[order]
+    return out_distances, out_ids
+
+def warmup(background=True):
+    def load_all():
+        get_client()
+        get_index()
+        if HIERARCHICAL_ENABLED:
+            get_file_index()
+        if RERANK_ENABLED:
+            get_reranker()
+
+    if not background:
+        load_all()
+        return None
+
+    thread = threading.Thread(target=load_all, name="warmup", daemon=True)
+    thread.start()
+    return thread
 
 #Hybrid Retrieval
 
-def retrieve_chunks(query, top_k=TOP_K):
-    # vector search
-    query_vec =  embedder.encode([query], convert_to_numpy = True)
-    distances, indices = index.search(query_vec, top_k * 2)
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# Maximal Marginal Relevance: greedily pick the candidate with the best
+# lambda * relevance - (1 - lambda) * (max similarity to the chunks already picked)
+def mmr_select(query_vec, candidate_vecs, top_k, lambda_mult=MMR_LAMBDA, relevance=None):
+    candidates = normalize_rows(candidate_vecs)
+    if relevance is None:
+        relevance = candidates @ normalize_rows(query_vec)[0]
+    similarity = candidates @ candidates.T
+
+    picked = np.zeros(len(candidates), dtype=bool)
+    max_sim = np.full(len(candidates), -np.inf)
+    selected = []
+
+    for _ in range(min(top_k, len(candidates))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        else:
+            scores = relevance.copy()
+        scores[picked] = -np.inf
+
+        best = int(np.argmax(scores))
+        selected.append(best)
+        picked[best] = True
+        max_sim = np.maximum(max_sim, similarity[best])
+
+    return selected
+
+def get_reranker():
+    global reranker
+    with _init_lock:
+        if reranker is None:
+            from sentence_transformers import CrossEncoder
+            reranker = CrossEncoder(RERANK_MODEL)
+    return reranker
+
+def score_pairs(query_key, query, ids):
+    # one padded batch for all (query, chunk) pairs
+    pairs = [(query, DOCUMENT_CHUNKS[i]["content"]) for i in ids]
+    scores = get_reranker().predict(pairs, batch_size=len(pairs))
+
+    with _rerank_cache_lock:
+        for i, score in zip(ids, scores):
+            _rerank_cache[(query_key, i)] = float(score)
+            _rerank_cache.move_to_end((query_key, i))
+        while len(_rerank_cache) > RERANK_CACHE_SIZE:
+            _rerank_cache.popitem(last=False)
+    return scores
+
+def rerank_chunks(query, ids, top_k, budget_ms=RERANK_BUDGET_MS):
+    query_key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+    with _rerank_cache_lock:
+        scores = {i: _rerank_cache.get((query_key, i)) for i in ids}
+
+    missing = [i for i in ids if scores[i] is None]
+    if missing:
+        # load the model first: the budget covers scoring, not a one-time load
+        get_reranker()
+        future = _rerank_pool.submit(score_pairs, query_key, query, missing)
+        try:
+            for i, score in zip(missing, future.result(timeout=budget_ms / 1000)):
+                scores[i] = float(score)
+        except concurrent.futures.TimeoutError:
+            # over budget: fall back to first-stage order; the scores still
+            # land in the cache when the batch finishes
+            return ids[:top_k]
+
+    return sorted(ids, key=lambda i: scores[i], reverse=True)[:top_k]
+
+# both legs run at the same time: encode + FAISS search release the GIL
+_retrieval_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval")
+
+# per-leg timings of the most recent retrieve_chunks call, in ms
+LAST_RETRIEVAL_STATS = {}
+
+def vector_search(query, top_k):
+    query_vec = get_embedder().encode([query], convert_to_numpy = True)
+    distances, indices = search_chunks(query_vec, top_k)
+    hits = [(int(i), 1 / (1 + float(d))) for i, d in zip(indices[0], distances[0]) if i != -1]
+    return query_vec, hits
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def fuse_rrf(rankings, weights):
+    fused = {}
+    for hits, weight in zip(rankings, weights):
+        for rank, (idx, score) in enumerate(hits, start=1):
+            fused[idx] = fused.get(idx, 0.0) + weight / (RRF_K + rank)
+    return fused
+
+def fuse_scores(rankings, weights):
+    fused = {}
+    for hits, weight in zip(rankings, weights):
+        if not hits:
+            continue
+        scores = [score for idx, score in hits]
+        lo, hi = min(scores), max(scores)
+        for idx, score in hits:
+            norm = (score - lo) / (hi - lo) if hi > lo else 1.0
+            fused[idx] = fused.get(idx, 0.0) + weight * norm
+    return fused
+
+def relevant_count(distances):
+    # IndexFlatL2 returns squared L2 and the MiniLM vectors are unit length,
+    # so cosine similarity = 1 - d / 2; distances come sorted, best first
+    similarity = [1 - float(d) / 2 for d in distances]
+    count = 0
+    for s in similarity:
+        if s < ADAPTIVE_MIN_SIMILARITY or s < similarity[0] * (1 - ADAPTIVE_MAX_DROP):
+            break
+        count += 1
+    return count
+
+def retrieve_chunks(query, top_k=TOP_K, diversify=MMR_ENABLED, fusion=FUSION, rerank=RERANK_ENABLED, adaptive=ADAPTIVE_TOP_K):
+    search_index = get_index()
+    start = time.perf_counter()
+    first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    fetch_k = first_k * 2 * (MMR_FETCH_FACTOR if diversify else 1)
+    if adaptive:
+        fetch_k = max(fetch_k, ADAPTIVE_FETCH_K)
+
+    # vector search and full-corpus keyword search, concurrently
+    vector_future = _retrieval_pool.submit(timed, vector_search, strip_operators(query), fetch_k)
+    keyword_future = _retrieval_pool.submit(timed, keyword_search, query, fetch_k)
+    (query_vec, vector_hits), vector_ms = vector_future.result()
+    (matched, keyword_hits), keyword_ms = keyword_future.result()
+
+    if adaptive and vector_hits:
+        # result size from the dense leg's distance distribution (RRF scores
+        # are rank-based and say nothing about relevance); the keyword leg can
+        # still promote chunks into those slots
+        relevant = relevant_count([1 / score - 1 for idx, score in vector_hits])
+        top_k = min(max(relevant, ADAPTIVE_MIN_K), top_k, ADAPTIVE_MAX_K)
+        first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+
+    rankings = [vector_hits, keyword_hits]
+    if fusion == "rrf":
+        fused = fuse_rrf(rankings, [RRF_VECTOR_WEIGHT, RRF_KEYWORD_WEIGHT])
+    else:
+        fused = fuse_scores(rankings, [VECTOR_WEIGHT, KEYWORD_WEIGHT])
+
+    # quoted phrases / NEAR clauses are hard filters; if nothing matches them
+    # the result is empty rather than quietly falling back to a loose search
+    if matched is not None:
+        fused = {idx: score for idx, score in fused.items() if idx in matched}
+
+    candidates = sorted(fused.items(), key = lambda x:x[1], reverse=True)
+
+    if diversify and candidates:
+        # MMR over the fused scores, rescaled to [0, 1] to be comparable with cosine similarity
+        ids = [idx for idx, score in candidates]
+        scores = np.array([score for idx, score in candidates])
+        relevance = (scores - scores.min()) / max(scores.max() - scores.min(), 1e-12)
+        candidate_vecs = search_index.reconstruct_batch(np.array(ids, dtype="int64"))
+        picked = [ids[i] for i in mmr_select(query_vec, candidate_vecs, first_k, relevance=relevance)]
+    else:
+        picked = [idx for idx, score in candidates[:first_k]]
+
+    rerank_ms = 0.0
+    if rerank and picked:
+        picked, rerank_ms = timed(rerank_chunks, query, picked, top_k)
+
+    LAST_RETRIEVAL_STATS.clear()
+    LAST_RETRIEVAL_STATS.update({
+        "vector_ms": round(vector_ms, 2),
+        "keyword_ms": round(keyword_ms, 2),
+        "positional_matches": None if matched is None else len(matched),
+        "rerank_ms": round(rerank_ms, 2),
+        "returned": len(picked),
+        "total_ms": round((time.perf_counter() - start) * 1000, 2)
+    })
+
+    return [DOCUMENT_CHUNKS[idx] for idx in picked]
+
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
 
-    candidates = []
-    for idx, dist in zip(indices[0], distances[0]):
-        vec_score = 1 / (1 + dist)
-        key_score = keyword_score(DOCUMENT_CHUNKS[idx]["content"], query)
-        final_score = (0.7 * vec_score) + (0.3 * key_score)
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
 
-        candidates.append((final_score, DOCUMENT_CHUNKS[idx]))
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
 
-    candidates.sort(key = lambda x:x[0], reverse=True)
-    return [chunk for score, chunk in candidates[:top_k]]
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
 
 tools = [
     {
@@ -89,14 +748,30 @@ tools = [
 ]
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = messages,
         tools = tools
     )
 
+def retrieve_context(args):
+    results = retrieve_chunks(**args)
+    print("Retrieval latency (ms):", LAST_RETRIEVAL_STATS)
+
+    context, pack_stats = pack_context(results)
+    print("Context tokens:", pack_stats)
+    return context
+
+def context_message(query):
+    return {
+        "role": "system",
+        "content": "Retrieved context (call retrieve_chunks if you need more):\n\n" + retrieve_context({"query": query})
+    }
+
 def run_agent(query):
     messages = [{"role":"user", "content": query }]
+    if PRE_RETRIEVAL:
+        messages.insert(0, context_message(query))
 
     while True:
         response = call_model(messages)
@@ -109,12 +784,7 @@ def run_agent(query):
         if msg.tool_calls:
             for call in msg.tool_calls:
                 args = json.loads(call.function.arguments)
-                results = retrieve_chunks(**args)
-
-                context = "\n\n".join(
-                    f"[{r['file']}]\n{r['content']}"
-                    for r in results
-                )
+                context = retrieve_context(args)
 
                 messages.append({"role": "assistant", "tool_calls": msg.tool_calls})
                 messages.append({
@@ -123,8 +793,10 @@ def run_agent(query):
                     "content": context
                 })
 
-query = "What are the major threats to ocean health?"
-run_agent(query)
+if __name__ == "__main__":
+    warmup()
+    query = "What are the major threats to ocean health?"
+    run_agent(query)
 
 
 # Expected Output:
@@ -0,0 +1,169 @@
+# Episodic memory: recall the past turns that matter instead of replaying them.
+#
+# Every answered question (user turn + assistant answer = one episode) is
+# embedded with the agent's embedder and added to a per-session FAISS index.
+# For a new question the prompt gets
+#
+#   the top_k most similar earlier episodes (cosine >= min_similarity)
+#   + the last recent_turns exchanges, verbatim
+#
+# so its size stays flat however long the session gets, and a fact from
+# turn 3 can still come back at turn 3000. With max_tokens both are also
+# capped by the store's token counts: the recent turns go first (newest first),
+# the episodes (most similar first) get what is left.
+#
+# Episode vectors are saved in the session store, so a resumed session only
+# embeds the episodes it has never seen. Indexes of at most cache_size
+# sessions are kept in memory (LRU).
+#
+#   memory = EpisodicMemory(store, embedder)
+#   messages = memory.context(session_id, query, max_tokens=1000)
+#   memory.add(session_id, seq, query, answer)
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CACHE_SIZE = 100
+RECENT_TURNS = 3
+TOP_K = 3
+MIN_SIMILARITY = 0.3
+
+def episode_text(user_msg, assistant_msg):
+    return f"User: {user_msg}\nAssistant: {assistant_msg}"
+
+def pair_turns(turns):
+    # (seq of the question, question, answer) for every answered question
+    return [
+        (q["seq"], q["content"], a["content"])
+        for q, a in zip(turns, turns[1:])
+        if q["role"] == "user" and a["role"] == "assistant"
+    ]
+
+def episode_tokens(turns):
+    # seq of the question -> tokens of question + answer
+    return {
+        q["seq"]: q["tokens"] + a["tokens"]
+        for q, a in zip(turns, turns[1:])
+        if q["role"] == "user" and a["role"] == "assistant"
+    }
+
+class EpisodicMemory:
+
+    def __init__(self, store, embedder, cache_size=CACHE_SIZE):
+        self.store = store
+        self.embedder = embedder
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+
+    def encode(self, texts):
+        vectors = np.asarray(self.embedder.encode(texts, convert_to_numpy=True), dtype="float32")
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def load(self, session_id):
+        import faiss
+
+        with self.lock:
+            if session_id in self.cache:
+                self.cache.move_to_end(session_id)
+                return self.cache[session_id]
+
+            turns = self.store.turns(session_id)
+            episodes = pair_turns(turns)
+            stored = dict(self.store.episodes(session_id))
+
+            # sessions from before the episodic memory: embed once, in one batch
+            missing = [e for e in episodes if e[0] not in stored]
+            if missing:
+                vectors = self.encode([episode_text(q, a) for seq, q, a in missing])
+                for (seq, q, a), vector in zip(missing, vectors):
+                    self.store.add_episode(session_id, seq, vector.tobytes())
+                    stored[seq] = vector.tobytes()
+
+            memory = {"index": None, "episodes": [], "tokens": episode_tokens(turns)}
+            if episodes:
+                vectors = np.stack([np.frombuffer(stored[seq], dtype="float32") for seq, q, a in episodes])
+                memory["index"] = faiss.IndexFlatIP(vectors.shape[1])
+                memory["index"].add(vectors)
+                memory["episodes"] = episodes
+
+            self.cache[session_id] = memory
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return memory
+
+    def add(self, session_id, seq, user_msg, assistant_msg):
+        import faiss
+
+        with self.lock:
+            memory = self.load(session_id)
+            if memory["episodes"] and memory["episodes"][-1][0] == seq:
+                # load() already picked it up from the store
+                return
+            vector = self.encode([episode_text(user_msg, assistant_msg)])
+            self.store.add_episode(session_id, seq, vector[0].tobytes())
+            if memory["index"] is None:
+                memory["index"] = faiss.IndexFlatIP(vector.shape[1])
+            memory["index"].add(vector)
+            memory["episodes"].append((seq, user_msg, assistant_msg))
+            # the store counted the tokens when the turns were appended
+            tail = [t for t in self.store.load(session_id) if t["seq"] in (seq, seq + 1)]
+            memory["tokens"].update(episode_tokens(tail))
+
+    def search(self, session_id, query, top_k=TOP_K, min_similarity=MIN_SIMILARITY, exclude=(), max_tokens=None):
+        with self.lock:
+            memory = self.load(session_id)
+            if memory["index"] is None or top_k <= 0:
+                return []
+            # over-fetch so excluded (recent) episodes don't use up the slots
+            k = min(top_k + len(exclude), memory["index"].ntotal)
+            scores, ids = memory["index"].search(self.encode([query]), k)
+            episodes = memory["episodes"]
+            tokens = memory["tokens"]
+
+        hits = [
+            episodes[i] for i, score in zip(ids[0], scores[0])
+            if i != -1 and score >= min_similarity and episodes[i][0] not in exclude
+        ][:top_k]
+        if max_tokens is not None:
+            # most similar first; an episode that doesn't fit is skipped
+            picked, used = [], 0
+            for episode in hits:
+                cost = tokens.get(episode[0], 0)
+                if used + cost <= max_tokens:
+                    picked.append(episode)
+                    used += cost
+            hits = picked
+        # chronological order reads better in the prompt
+        return sorted(hits)
+
+    def context(self, session_id, query, recent_turns=RECENT_TURNS, top_k=TOP_K, min_similarity=MIN_SIMILARITY, max_tokens=None):
+        recent = list(self.store.load(session_id))[-2 * recent_turns:] if recent_turns > 0 else []
+        used = 0
+        if max_tokens is not None:
+            # newest turns first until the budget is spent, like store.window()
+            picked = []
+            for turn in reversed(recent):
+                if used + turn["tokens"] > max_tokens:
+                    break
+                picked.append(turn)
+                used += turn["tokens"]
+            recent = picked[::-1]
+        while recent and recent[0]["role"] != "user":
+            used -= recent.pop(0)["tokens"]
+
+        hits = self.search(
+            session_id, query, top_k, min_similarity,
+            exclude = {t["seq"] for t in recent},
+            max_tokens = None if max_tokens is None else max_tokens - used
+        )
+
+        messages = []
+        if hits:
+            messages.append({
+                "role": "assistant",
+                "content": "Relevant earlier conversation:\n\n" + "\n\n".join(episode_text(q, a) for seq, q, a in hits)
+            })
+        messages.extend({"role": t["role"], "content": t["content"]} for t in recent)
+        return messages
@@ -0,0 +1,177 @@
+# Persistent, bounded conversation memory for the conversational agent.
+#
+# Every turn is written straight to SQLite (one row per message), so nothing
+# is lost when the process exits and a conversation can be resumed by its
+# session id. Only the tail of each active session is kept in memory, in an
+# LRU of at most cache_size sessions; evicting a session just drops the cached
+# tail, the turns are already on disk.
+#
+# The prompt never gets the whole history, only window(): the most recent
+# turns that fit in a token budget.
+#
+#   store = SessionStore("./sessions.db")
+#   store.append(session_id, "user", "What threatens the oceans?")
+#   messages = store.window(session_id, max_tokens=1000)
+#
+# The episodes table holds one embedding per answered question, for the
+# episodic memory (episodic_memory.py), so resuming does not re-embed.
+
+import time,sqlite3,threading
+from collections import OrderedDict, deque
+
+CACHE_SIZE = 100
+CACHED_TURNS = 200
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+class SessionStore:
+
+    def __init__(self, path, cache_size=CACHE_SIZE, cached_turns=CACHED_TURNS):
+        self.path = path
+        self.cache_size = cache_size
+        self.cached_turns = cached_turns
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS episodes (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+        """)
+        self.db.commit()
+
+    def load(self, session_id):
+        # tail of one session, from the LRU or (on resume) from disk
+        with self.lock:
+            if session_id in self.cache:
+                self.cache.move_to_end(session_id)
+                return self.cache[session_id]
+
+            rows = self.db.execute(
+                "SELECT seq, role, content, tokens FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, self.cached_turns)
+            ).fetchall()
+            turns = deque(
+                ({"seq": seq, "role": role, "content": content, "tokens": tokens} for seq, role, content, tokens in reversed(rows)),
+                maxlen = self.cached_turns
+            )
+
+            self.cache[session_id] = turns
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return turns
+
+    def append(self, session_id, role, content):
+        with self.lock:
+            turns = self.load(session_id)
+            if turns:
+                seq = turns[-1]["seq"] + 1
+            else:
+                row = self.db.execute("SELECT MAX(seq) FROM turns WHERE session_id = ?", (session_id,)).fetchone()
+                seq = 0 if row[0] is None else row[0] + 1
+
+            turn = {"seq": seq, "role": role, "content": content, "tokens": count_tokens(content)}
+            self.db.execute(
+                "INSERT INTO turns (session_id, seq, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, seq, role, content, turn["tokens"], time.time())
+            )
+            self.db.commit()
+            turns.append(turn)
+            return turn
+
+    def window(self, session_id, max_tokens):
+        # newest turns first until the budget is spent, returned oldest first
+        with self.lock:
+            turns = list(self.load(session_id))
+
+        picked, used = [], 0
+        for turn in reversed(turns):
+            if used + turn["tokens"] > max_tokens:
+                break
+            picked.append(turn)
+            used += turn["tokens"]
+        picked.reverse()
+
+        # don't open the window with an answer whose question fell out of it
+        while picked and picked[0]["role"] != "user":
+            picked.pop(0)
+        return [{"role": t["role"], "content": t["content"]} for t in picked]
+
+    def turns(self, session_id):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT seq, role, content, tokens FROM turns WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        return [{"seq": seq, "role": role, "content": content, "tokens": tokens} for seq, role, content, tokens in rows]
+
+    def add_episode(self, session_id, seq, vector):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO episodes (session_id, seq, vector) VALUES (?, ?, ?)",
+                (session_id, seq, vector)
+            )
+            self.db.commit()
+
+    def episodes(self, session_id):
+        with self.lock:
+            return self.db.execute(
+                "SELECT seq, vector FROM episodes WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+
+    def history(self, session_id):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT role, content FROM turns WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def sessions(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT session_id, COUNT(*), MAX(created_at) FROM turns GROUP BY session_id ORDER BY MAX(created_at) DESC"
+            ).fetchall()
+        return [{"session_id": sid, "turns": n, "last_active": last} for sid, n, last in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,18 +1,109 @@
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-import faiss
-import os,json
+import os,sys,hashlib,re,json,threading
+from collections import OrderedDict
+import concurrent.futures
 from dotenv import load_dotenv
+import numpy as np
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
 DOCS_PATH = "./docs"
 CHUNK_SIZE = 120
 TOP_K = 3
 
-embedder = SentenceTransformer("all-MiniLm-L6-v2")
+# MMR diversification: over-fetch MMR_FETCH_FACTOR * top_k candidates and pick a
+# top_k that trades relevance (lambda = 1) against redundancy (lambda = 0)
+MMR_ENABLED = False
+MMR_LAMBDA = 0.5
+MMR_FETCH_FACTOR = 4
+
+# Cross-encoder re-ranking of the first-stage hits. Scoring is cached per
+# (query, chunk) and must finish within RERANK_BUDGET_MS, otherwise the
+# first-stage order is kept.
+RERANK_ENABLED = False
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 10
+RERANK_BUDGET_MS = 300
+RERANK_CACHE_SIZE = 10000
+
+# Query-focused compression of retrieved chunks: keep at most
+# COMPRESS_MAX_SENTENCES sentences per chunk with cosine similarity to the query
+# of at least COMPRESS_THRESHOLD
+COMPRESS_ENABLED = True
+COMPRESS_THRESHOLD = 0.35
+COMPRESS_MAX_SENTENCES = 2
+
+# Adaptive top_k: look at the ADAPTIVE_FETCH_K nearest chunks and return only the
+# ones with cosine similarity >= ADAPTIVE_MIN_SIMILARITY that are within
+# ADAPTIVE_MAX_DROP (relative) of the best hit; at least ADAPTIVE_MIN_K, at most
+# ADAPTIVE_MAX_K and never more than the requested top_k
+ADAPTIVE_TOP_K = True
+ADAPTIVE_MIN_K = 1
+ADAPTIVE_MAX_K = 8
+ADAPTIVE_FETCH_K = 10
+ADAPTIVE_MIN_SIMILARITY = 0.3
+ADAPTIVE_MAX_DROP = 0.3
+
+# Two-level retrieval: route the query to the ROUTE_TOP_FILES files whose
+# centroid (mean of their chunk vectors) is closest, then search only those
+# files' chunk indexes. Search cost grows with files routed, not corpus size.
+# Trade-off: the per-file shards hold a second copy of every chunk vector next
+# to the flat index (kept for MMR and the flat fallback), so vector memory
+# doubles while this is on.
+HIERARCHICAL_ENABLED = False
+ROUTE_TOP_FILES = 8
+
+# Semantic answer cache (semantic_cache.py) in front of run_agent: a paraphrase
+# of an answered question gets the cached answer when its retrieved chunks are
+# the same and the document index has not changed
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.92
+ANSWER_CACHE_TTL = 24 * 3600
+ANSWER_CACHE_SIZE = 1000
+
+# Pre-retrieval: retrieve for the user's question before the first model call
+# and put the context in the prompt, saving the round trip in which the model
+# would only ask for it. retrieve_chunks stays available as a tool in case the
+# model wants more. False restores the tool-driven flow.
+PRE_RETRIEVAL = True
+
+# Heavy dependencies (groq, sentence_transformers, faiss) are loaded on first
+# use, so importing this module to reuse chunk_text / retrieve_chunks is cheap.
+# Call warmup() to pay the cost up front, optionally in the background.
+client = None
+embedder = None
+index = None
+DOCUMENT_CHUNKS = []
+index_version = None
+answer_cache = None
+file_index = None
+
+reranker = None
+_rerank_cache = OrderedDict()
+_rerank_cache_lock = threading.Lock()
+_rerank_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+_init_lock = threading.RLock()
+
+def get_client():
+    global client
+    with _init_lock:
+        if client is None:
+            from groq import Groq
+            client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+def get_embedder():
+    global embedder
+    with _init_lock:
+        if embedder is None and os.getenv("EMBEDDING_SERVER_URL"):
+            # share one batched model per machine (day19_embedding_server)
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "day19_embedding_server"))
+            from embedding_client import EmbeddingClient
+            embedder = EmbeddingClient(os.getenv("EMBEDDING_SERVER_URL"))
+        elif embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer("all-MiniLm-L6-v2")
+    return embedder
 
 def chunk_text(text):
     words = text.split()
@@ -27,32 +118,396 @@ def load_documents():
         if file.endswith(".txt"):
             with open(os.path.join(DOCS_PATH,file),"r", encoding="utf-8") as f:
                 text = f.read()
-                for chunk in chunk_text(text):
+                for i, chunk in enumerate(chunk_text(text)):
                     chunks.append({
                         "file": file,
-                        "content": chunk
+                        "content": chunk,
+                        "chunk": i
                     })
     return chunks
 
-DOCUMENT_CHUNKS = load_documents()
+def build_index(chunks):
+    import faiss
+
+    embeddings = get_embedder().encode(
+        [c["content"] for c in chunks],
+        convert_to_numpy = True
+    )
+
+    dimension = embeddings.shape[1]
+    new_index = faiss.IndexFlatL2(dimension)
+    new_index.add(embeddings)
+    return new_index
+
+def docs_version():
+    # changes whenever a document is added, removed or edited
+    h = hashlib.sha1()
+    for file in sorted(os.listdir(DOCS_PATH)):
+        if file.endswith(".txt"):
+            stat = os.stat(os.path.join(DOCS_PATH, file))
+            h.update(f"{file}:{stat.st_mtime_ns}:{stat.st_size}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def get_index():
+    global index, index_version, DOCUMENT_CHUNKS
+    with _init_lock:
+        if index is None:
+            index_version = docs_version()
+            DOCUMENT_CHUNKS = load_documents()
+            index = build_index(DOCUMENT_CHUNKS)
+    return index
+
+def refresh_index():
+    # rebuild when a document was added, removed or edited since the index was
+    # built, so cached answers tied to the old version stop being served
+    global index, file_index
+    with _init_lock:
+        if index is not None and docs_version() != index_version:
+            index, file_index = None, None
+            with _rerank_cache_lock:
+                _rerank_cache.clear()
+        return get_index()
+
+def get_answer_cache():
+    global answer_cache
+    with _init_lock:
+        if answer_cache is None:
+            sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+            from semantic_cache import SemanticCache
+            answer_cache = SemanticCache(
+                get_embedder(),
+                threshold = ANSWER_CACHE_THRESHOLD,
+                ttl = ANSWER_CACHE_TTL,
+                max_entries = ANSWER_CACHE_SIZE
+            )
+    return answer_cache
+
+def build_file_index(chunks, chunk_index):
+    import faiss
+
+    # reuse the stored chunk vectors instead of re-encoding, one file at a time
+    # so there is never a third full copy of them
+    by_file = {}
+    for i, chunk in enumerate(chunks):
+        by_file.setdefault(chunk["file"], []).append(i)
+
+    files, shards, centroids = [], [], []
+    for file, ids in by_file.items():
+        ids = np.array(ids, dtype="int64")
+        vectors = chunk_index.reconstruct_batch(ids)
+        shard = faiss.IndexFlatL2(vectors.shape[1])
+        shard.add(vectors)
+        files.append(file)
+        shards.append((shard, ids))
+        centroids.append(vectors.mean(axis=0))
+
+    # unit-length centroids, so routing ranks files by cosine similarity
+    centroids = np.array(centroids, dtype="float32")
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    router = faiss.IndexFlatL2(centroids.shape[1])
+    router.add(centroids)
+
+    return {"router": router, "files": files, "shards": shards}
+
+def get_file_index():
+    global file_index
+    with _init_lock:
+        if file_index is None:
+            chunk_index = get_index()
+            file_index = build_file_index(DOCUMENT_CHUNKS, chunk_index)
+    return file_index
+
+def search_chunks(query_vec, k, hierarchical=None):
+    # same (distances, indices) shape as index.search, padded with -1;
+    # the flag is read at call time, like warmup() does
+    if hierarchical is None:
+        hierarchical = HIERARCHICAL_ENABLED
+    if not hierarchical:
+        return get_index().search(query_vec, k)
+
+    tree = get_file_index()
+    _, routed = tree["router"].search(query_vec, min(ROUTE_TOP_FILES, len(tree["shards"])))
+
+    distances, ids = [], []
+    for f in routed[0]:
+        if f == -1:
+            continue
+        shard, shard_ids = tree["shards"][f]
+        d, i = shard.search(query_vec, min(k, shard.ntotal))
+        distances.extend(d[0])
+        ids.extend(shard_ids[i[0]])
+
+    order = np.argsort(distances, kind="stable")[:k]
+    out_distances = np.full((1, k), np.finfo("float32").max, dtype="float32")
+    out_ids = np.full((1, k), -1, dtype="int64")
+    out_distances[0, :len(order)] = np.array(distances, dtype="float32")[order]
+    out_ids[0, :len(order)] = np.array(ids, dtype="int64")[order]
+    return out_distances, out_ids
+
+def warmup(background=True):
+    def load_all():
+        get_client()
+        get_index()
+        if HIERARCHICAL_ENABLED:
+            get_file_index()
+        if RERANK_ENABLED:
+            get_reranker()
+
+    if not background:
+        load_all()
+        return None
+
+    thread = threading.Thread(target=load_all, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# Maximal Marginal Relevance: greedily pick the candidate with the best
+# lambda * relevance - (1 - lambda) * (max similarity to the chunks already picked)
+def mmr_select(query_vec, candidate_vecs, top_k, lambda_mult=MMR_LAMBDA, relevance=None):
+    candidates = normalize_rows(candidate_vecs)
+    if relevance is None:
+        relevance = candidates @ normalize_rows(query_vec)[0]
+    similarity = candidates @ candidates.T
+
+    picked = np.zeros(len(candidates), dtype=bool)
+    max_sim = np.full(len(candidates), -np.inf)
+    selected = []
+
+    for _ in range(min(top_k, len(candidates))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        else:
+            scores = relevance.copy()
+        scores[picked] = -np.inf
+
+        best = int(np.argmax(scores))
+        selected.append(best)
+        picked[best] = True
+        max_sim = np.maximum(max_sim, similarity[best])
+
+    return selected
+
+def get_reranker():
+    global reranker
+    with _init_lock:
+        if reranker is None:
+            from sentence_transformers import CrossEncoder
+            reranker = CrossEncoder(RERANK_MODEL)
+    return reranker
 
-embeddings = embedder.encode(
-    [c["content"] for c in DOCUMENT_CHUNKS],
-    convert_to_numpy = True
-)
+def score_pairs(query_key, query, ids):
+    # one padded batch for all (query, chunk) pairs
+    pairs = [(query, DOCUMENT_CHUNKS[i]["content"]) for i in ids]
+    scores = get_reranker().predict(pairs, batch_size=len(pairs))
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
+    with _rerank_cache_lock:
+        for i, score in zip(ids, scores):
+            _rerank_cache[(query_key, i)] = float(score)
+            _rerank_cache.move_to_end((query_key, i))
+        while len(_rerank_cache) > RERANK_CACHE_SIZE:
+            _rerank_cache.popitem(last=False)
+    return scores
 
-def retrieve_chunks(query, top_k=TOP_K):
-    query_vec = embedder.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(query_vec, top_k)
+def rerank_chunks(query, ids, top_k, budget_ms=RERANK_BUDGET_MS):
+    query_key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+    with _rerank_cache_lock:
+        scores = {i: _rerank_cache.get((query_key, i)) for i in ids}
 
-    results = []
-    for idx in indices[0]:
-        results.append(DOCUMENT_CHUNKS[idx])
-    return results
+    missing = [i for i in ids if scores[i] is None]
+    if missing:
+        # load the model first: the budget covers scoring, not a one-time load
+        get_reranker()
+        future = _rerank_pool.submit(score_pairs, query_key, query, missing)
+        try:
+            for i, score in zip(missing, future.result(timeout=budget_ms / 1000)):
+                scores[i] = float(score)
+        except concurrent.futures.TimeoutError:
+            # over budget: fall back to first-stage order; the scores still
+            # land in the cache when the batch finishes
+            return ids[:top_k]
+
+    return sorted(ids, key=lambda i: scores[i], reverse=True)[:top_k]
+
+def relevant_count(distances):
+    # IndexFlatL2 returns squared L2 and the MiniLM vectors are unit length,
+    # so cosine similarity = 1 - d / 2; distances come sorted, best first
+    similarity = [1 - float(d) / 2 for d in distances]
+    count = 0
+    for s in similarity:
+        if s < ADAPTIVE_MIN_SIMILARITY or s < similarity[0] * (1 - ADAPTIVE_MAX_DROP):
+            break
+        count += 1
+    return count
+
+def retrieve_chunks(query, top_k=TOP_K, diversify=MMR_ENABLED, rerank=RERANK_ENABLED, adaptive=ADAPTIVE_TOP_K):
+    query_vec = get_embedder().encode([query], convert_to_numpy=True)
+    search_index = get_index()
+
+    first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    fetch_k = first_k * MMR_FETCH_FACTOR if diversify else first_k
+    if adaptive:
+        fetch_k = max(fetch_k, ADAPTIVE_FETCH_K)
+    distances, indices = search_chunks(query_vec, fetch_k)
+    ids = [int(i) for i in indices[0] if i != -1]
+
+    if adaptive and ids:
+        # size the result by the distance distribution; only the final size
+        # shrinks, MMR / re-ranking still choose from the whole candidate pool
+        relevant = relevant_count(distances[0][:len(ids)])
+        top_k = min(max(relevant, ADAPTIVE_MIN_K), top_k, ADAPTIVE_MAX_K)
+        first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+
+    if diversify and ids:
+        # reuse the stored vectors instead of re-encoding the candidate chunks
+        candidate_vecs = search_index.reconstruct_batch(np.array(ids, dtype="int64"))
+        ids = [ids[i] for i in mmr_select(query_vec, candidate_vecs, first_k)]
+
+    if rerank and ids:
+        ids = rerank_chunks(query, ids, top_k)
+
+    return [DOCUMENT_CHUNKS[i] for i in ids[:top_k]]
+
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
+
+# Query-focused compression: a chunk is cut down to its sentences that are
+# most similar to the query, so only the evidence goes to the model.
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+def split_sentences(text):
+    return [s for s in SENTENCE_RE.split(text.strip()) if s]
+
+def compress_chunks(query, results, threshold=COMPRESS_THRESHOLD, max_sentences=COMPRESS_MAX_SENTENCES):
+    sentences = [split_sentences(r["content"]) for r in results]
+    flat = [s for group in sentences for s in group]
+    stats = {"sentences": len(flat), "kept": len(flat), "ratio": 1.0}
+    if not flat:
+        return results, stats
+
+    # the query and every sentence in one encode call
+    vectors = get_embedder().encode([query] + flat, convert_to_numpy=True)
+    vectors = normalize_rows(np.asarray(vectors, dtype="float32"))
+    similarity = vectors[1:] @ vectors[0]
+
+    compressed, offset = [], 0
+    for r, group in zip(results, sentences):
+        sims = similarity[offset:offset + len(group)]
+        offset += len(group)
+        best = [i for i in np.argsort(-sims, kind="stable")[:max_sentences] if sims[i] >= threshold]
+        if best:
+            # keep the original sentence order; file / chunk tags stay for citations
+            compressed.append(dict(r, content=" ".join(group[i] for i in sorted(best))))
+
+    # nothing clears the threshold: better to send the chunks than nothing
+    if not compressed:
+        return results, stats
+
+    before = sum(count_tokens(r["content"]) for r in results)
+    after = sum(count_tokens(r["content"]) for r in compressed)
+    stats["kept"] = sum(len(split_sentences(r["content"])) for r in compressed)
+    stats["ratio"] = round(before / after, 2)
+    return compressed, stats
 
 tools = [
     {
@@ -82,14 +537,50 @@ SYSTEM = {
 }
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=messages,
         tools=tools
     )
 
+def evidence_ids(results):
+    return {(c["file"], c["chunk"]) for c in results}
+
+def retrieve_context(args, results=None):
+    if results is None:
+        results = retrieve_chunks(**args)
+    if COMPRESS_ENABLED:
+        results, compress_stats = compress_chunks(args["query"], results)
+        print("Compression:", compress_stats)
+
+    context, pack_stats = pack_context(results)
+    print("Context tokens:", pack_stats)
+    return context
+
+def context_message(query, results=None):
+    return {
+        "role": "system",
+        "content": "Retrieved context (call retrieve_chunks if you need more):\n\n" + retrieve_context({"query": query}, results)
+    }
+
 def run_agent(query):
+    refresh_index()
+
+    # one retrieval for the question serves the cache check, the pre-retrieved
+    # context and the evidence stored with the answer
+    results = retrieve_chunks(query) if ANSWER_CACHE_ENABLED or PRE_RETRIEVAL else None
+
+    if ANSWER_CACHE_ENABLED:
+        evidence = evidence_ids(results)
+        cached = get_answer_cache().get(query, index_version, lambda: evidence)
+        if cached:
+            print("\nFinal Answer with Sources (cached):\n", cached)
+            print("Answer cache:", answer_cache.stats())
+            return cached
+
     messages = [SYSTEM, {"role":"user", "content": query}]
+    if PRE_RETRIEVAL:
+        messages.insert(1, context_message(query, results))
 
     while True:
         response = call_model(messages)
@@ -97,17 +588,15 @@ def run_agent(query):
 
         if msg.content:
             print("\nFinal Answer with Sources:\n", msg.content)
-            break
+            if ANSWER_CACHE_ENABLED:
+                answer_cache.put(query, msg.content, evidence, index_version)
+                print("Answer cache:", answer_cache.stats())
+            return msg.content
 
         if msg.tool_calls:
             for call in msg.tool_calls:
                 args = json.loads(call.function.arguments)
-                results = retrieve_chunks(**args)
-
-                context = "\n\n".join(
-                    f"[{r['file']}]\n{r['content']}"
-                    for r in results
-                )
+                context = retrieve_context(args)
 
                 messages.append({"role":"assistant", "tool_calls":msg.tool_calls})
                 messages.append({
@@ -117,8 +606,10 @@ def run_agent(query):
                 })
 
 
-query = "What are the major threats to ocean health?"
-run_agent(query)
+if __name__ == "__main__":
+    warmup()
+    query = "What are the major threats to ocean health?"
+    run_agent(query)
 
 
 # Expected Output:
@@ -0,0 +1,129 @@
+# Semantic answer cache: paraphrases of a question already answered get the
+# stored answer back without retrieval + LLM round trips.
+#
+# A lookup embeds the normalized question and searches a small FAISS index of
+# earlier questions. The best match is served only if
+#
+#   cosine similarity >= threshold
+#   the entry is younger than ttl seconds
+#   it was answered against the same document index version
+#   retrieval for the new question still returns the same chunk ids
+#
+# so an answer is never reused once the evidence behind it has changed.
+# At most max_entries answers are kept; the least recently used go first.
+#
+#   cache = SemanticCache(embedder)
+#   answer = cache.get(query, version, lambda: chunk_ids(query))
+#   cache.put(query, answer, chunk_ids(query), version)
+#   cache.stats()
+
+import re,time,threading
+from collections import OrderedDict
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.92
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 1000
+
+def normalize_query(query):
+    return re.sub(r"[\s?!.]+$", "", " ".join(query.lower().split()))
+
+class SemanticCache:
+
+    def __init__(self, embedder, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.index = None
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.RLock()
+        self.metrics = {
+            "lookups": 0,
+            "hits": 0,
+            "no_match": 0,
+            "expired": 0,
+            "stale_index": 0,
+            "evidence_changed": 0,
+            "evicted": 0
+        }
+
+    def encode(self, query):
+        vector = np.asarray(self.embedder.encode([normalize_query(query)], convert_to_numpy=True), dtype="float32")
+        return vector / np.maximum(np.linalg.norm(vector, axis=1, keepdims=True), 1e-12)
+
+    def remove(self, entry_id):
+        self.index.remove_ids(np.array([entry_id], dtype="int64"))
+        del self.entries[entry_id]
+
+    def miss(self, reason, entry_id=None):
+        self.metrics[reason] += 1
+        if entry_id is not None:
+            self.remove(entry_id)
+        return None
+
+    def get(self, query, version, chunk_ids):
+        # chunk_ids is called only when there is a candidate to confirm
+        query_vec = self.encode(query)
+        with self.lock:
+            self.metrics["lookups"] += 1
+            if not self.entries:
+                return self.miss("no_match")
+
+            scores, ids = self.index.search(query_vec, 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            if entry_id == -1 or score < self.threshold:
+                return self.miss("no_match")
+
+            entry = self.entries[entry_id]
+            if time.time() - entry["created_at"] > self.ttl:
+                return self.miss("expired", entry_id)
+            if entry["version"] != version:
+                return self.miss("stale_index", entry_id)
+
+        current = frozenset(chunk_ids())
+
+        with self.lock:
+            if entry_id not in self.entries:
+                return self.miss("no_match")
+            if current != entry["chunk_ids"]:
+                return self.miss("evidence_changed", entry_id)
+
+            self.entries.move_to_end(entry_id)
+            entry["hits"] += 1
+            self.metrics["hits"] += 1
+            return entry["answer"]
+
+    def put(self, query, answer, chunk_ids, version):
+        import faiss
+
+        query_vec = self.encode(query)
+        with self.lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(query_vec.shape[1]))
+
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(query_vec, np.array([entry_id], dtype="int64"))
+            self.entries[entry_id] = {
+                "query": query,
+                "answer": answer,
+                "chunk_ids": frozenset(chunk_ids),
+                "version": version,
+                "created_at": time.time(),
+                "hits": 0
+            }
+
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.metrics["evicted"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["entries"] = len(self.entries)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        return stats
@@ -1,20 +1,120 @@
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-import faiss
-import os,json
+import os,sys,re,json,time,threading
+from collections import Counter, OrderedDict
+import concurrent.futures
 from dotenv import load_dotenv
+import numpy as np
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
 DOCS_PATH = "./docs"
 CHUNK_SIZE = 120
 TOP_K = 3
 
-embedder = SentenceTransformer("all-MiniLm-L6-v2")
+# MMR diversification: over-fetch MMR_FETCH_FACTOR * top_k candidates and pick a
+# top_k that trades relevance (lambda = 1) against redundancy (lambda = 0)
+MMR_ENABLED = False
+MMR_LAMBDA = 0.5
+MMR_FETCH_FACTOR = 4
+
+# Adaptive top_k: look at the ADAPTIVE_FETCH_K nearest chunks and return only the
+# ones with cosine similarity >= ADAPTIVE_MIN_SIMILARITY that are within
+# ADAPTIVE_MAX_DROP (relative) of the best hit; at least ADAPTIVE_MIN_K, at most
+# ADAPTIVE_MAX_K and never more than the requested top_k
+ADAPTIVE_TOP_K = True
+ADAPTIVE_MIN_K = 1
+ADAPTIVE_MAX_K = 8
+ADAPTIVE_FETCH_K = 10
+ADAPTIVE_MIN_SIMILARITY = 0.3
+ADAPTIVE_MAX_DROP = 0.3
+
+# Two-level retrieval: route the query to the ROUTE_TOP_FILES files whose
+# centroid (mean of their chunk vectors) is closest, then search only those
+# files' chunk indexes. Search cost grows with files routed, not corpus size.
+# Trade-off: the per-file shards hold a second copy of every chunk vector next
+# to the flat index (kept for MMR and the flat fallback), so vector memory
+# doubles while this is on.
+HIERARCHICAL_ENABLED = False
+ROUTE_TOP_FILES = 8
+
+# Multi-query expansion: retrieve with up to MAX_EXPANSIONS reformulations of
+# the query (rule-based, or one LLM call with EXPANSION_LLM), embedded in one
+# batch, searched in one stacked call and fused with reciprocal rank fusion
+QUERY_EXPANSION = True
+EXPANSION_LLM = False
+MAX_EXPANSIONS = 4
+CONTEXT_TERMS = 4
+EXPANSION_CACHE_SIZE = 1000
+RRF_K = 60
+
+# Memory is summarized off the request path: finished turns are queued and a
+# background worker closes a segment every SUMMARY_EVERY_TURNS turns or
+# SUMMARY_EVERY_TOKENS tokens. Every memory version is appended to MEMORY_PATH.
+SUMMARY_EVERY_TURNS = 3
+SUMMARY_EVERY_TOKENS = 800
+MEMORY_PATH = "./memory.jsonl"
+
+# Hierarchical memory: each segment is summarized once (SEGMENT_TOKEN_CAP), and
+# every ROLLUP_FANOUT summaries of one level are rolled into one summary of the
+# next level (ROLLUP_TOKEN_CAP). Each summarization sees a fixed amount of
+# text, so the cost per turn stays flat however long the session gets.
+SEGMENT_TOKEN_CAP = 150
+ROLLUP_TOKEN_CAP = 200
+ROLLUP_FANOUT = 4
+
+# Pre-retrieval: retrieve for the user's question before the first model call
+# and put the context in the prompt, saving the round trip in which the model
+# would only ask for it. retrieve_chunks stays available as a tool in case the
+# model wants more. False restores the tool-driven flow.
+PRE_RETRIEVAL = True
+
+# Heavy dependencies (groq, sentence_transformers, faiss) are loaded on first
+# use, so importing this module to reuse chunk_text / retrieve_chunks is cheap.
+# Call warmup() to pay the cost up front, optionally in the background.
+client = None
+embedder = None
+index = None
+DOCUMENT_CHUNKS = []
+file_index = None
+
+_expansion_cache = OrderedDict()
+_expansion_lock = threading.Lock()
+
+_init_lock = threading.RLock()
+
+def get_client():
+    global client
+    with _init_lock:
+        if client is None:
+            from groq import Groq
+            client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+def get_embedder():
+    global embedder
+    with _init_lock:
+        if embedder is None and os.getenv("EMBEDDING_SERVER_URL"):
+            # share one batched model per machine (day19_embedding_server)
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "day19_embedding_server"))
+            from embedding_client import EmbeddingClient
+            embedder = EmbeddingClient(os.getenv("EMBEDDING_SERVER_URL"))
+        elif embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer("all-MiniLm-L6-v2")
+    return embedder
 
 memory_summary = ""
+memory_version = 0
+
+# memory_levels[0] holds segment summaries, memory_levels[i] rollups of level
+# i - 1; only summaries not rolled up yet are kept
+memory_levels = []
+
+# turns not covered by a finished summary yet; the first _queued_turns of them
+# are with the summary worker
+_recent_turns = []
+_queued_turns = 0
+_memory_lock = threading.Lock()
+_summary_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
 
 def chunk_text(text):
     words = text.split()
@@ -29,47 +129,510 @@ def load_documents():
         if file.endswith(".txt"):
             with open(os.path.join(DOCS_PATH,file), "r", encoding="utf-8") as f:
                 text = f.read()
-            for chunk in chunk_text(text):
+            for i, chunk in enumerate(chunk_text(text)):
                 chunks.append({
                     "file": file,
-                    "content": chunk
+                    "content": chunk,
+                    "chunk": i
                 })
     return chunks
 
-DOCUMENT_CHUNKS = load_documents()
+def build_index(chunks):
+    import faiss
+
+    embeddings = get_embedder().encode(
+        [c["content"] for c in chunks],
+        convert_to_numpy = True
+    )
 
-embeddings= embedder.encode([c["content"] for c in DOCUMENT_CHUNKS], convert_to_numpy=True)
+    dimension = embeddings.shape[1]
+    new_index = faiss.IndexFlatL2(dimension)
+    new_index.add(embeddings)
+    return new_index
+
+def get_index():
+    global index, DOCUMENT_CHUNKS
+    with _init_lock:
+        if index is None:
+            DOCUMENT_CHUNKS = load_documents()
+            index = build_index(DOCUMENT_CHUNKS)
+    return index
+
+def build_file_index(chunks, chunk_index):
+    import faiss
+
+    # reuse the stored chunk vectors instead of re-encoding, one file at a time
+    # so there is never a third full copy of them
+    by_file = {}
+    for i, chunk in enumerate(chunks):
+        by_file.setdefault(chunk["file"], []).append(i)
+
+    files, shards, centroids = [], [], []
+    for file, ids in by_file.items():
+        ids = np.array(ids, dtype="int64")
+        vectors = chunk_index.reconstruct_batch(ids)
+        shard = faiss.IndexFlatL2(vectors.shape[1])
+        shard.add(vectors)
+        files.append(file)
+        shards.append((shard, ids))
+        centroids.append(vectors.mean(axis=0))
+
+    # unit-length centroids, so routing ranks files by cosine similarity
+    centroids = np.array(centroids, dtype="float32")
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    router = faiss.IndexFlatL2(centroids.shape[1])
+    router.add(centroids)
+
+    return {"router": router, "files": files, "shards": shards}
+
+def get_file_index():
+    global file_index
+    with _init_lock:
+        if file_index is None:
+            chunk_index = get_index()
+            file_index = build_file_index(DOCUMENT_CHUNKS, chunk_index)
+    return file_index
+
+def search_chunks(query_vec, k, hierarchical=None):
+    # same (distances, indices) shape as index.search, padded with -1;
+    # the flag is read at call time, like warmup() does
+    if hierarchical is None:
+        hierarchical = HIERARCHICAL_ENABLED
+    if not hierarchical:
+        return get_index().search(query_vec, k)
+
+    tree = get_file_index()
+    _, routed = tree["router"].search(query_vec, min(ROUTE_TOP_FILES, len(tree["shards"])))
+
+    # one row per query, like index.search
+    out_distances = np.full((len(query_vec), k), np.finfo("float32").max, dtype="float32")
+    out_ids = np.full((len(query_vec), k), -1, dtype="int64")
+    for row, files in enumerate(routed):
+        distances, ids = [], []
+        for f in files:
+            if f == -1:
+                continue
+            shard, shard_ids = tree["shards"][f]
+            d, i = shard.search(query_vec[row:row + 1], min(k, shard.ntotal))
+            distances.extend(d[0])
+            ids.extend(shard_ids[i[0]])
+
+        order = np.argsort(distances, kind="stable")[:k]
+        out_distances[row, :len(order)] = np.array(distances, dtype="float32")[order]
+        out_ids[row, :len(order)] = np.array(ids, dtype="int64")[order]
+    return out_distances, out_ids
+
+def warmup(background=True):
+    def load_all():
+        get_client()
+        get_index()
+        if HIERARCHICAL_ENABLED:
+            get_file_index()
+
+    if not background:
+        load_all()
+        return None
+
+    thread = threading.Thread(target=load_all, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# Maximal Marginal Relevance: greedily pick the candidate with the best
+# lambda * relevance - (1 - lambda) * (max similarity to the chunks already picked)
+def mmr_select(query_vec, candidate_vecs, top_k, lambda_mult=MMR_LAMBDA, relevance=None):
+    candidates = normalize_rows(candidate_vecs)
+    if relevance is None:
+        relevance = candidates @ normalize_rows(query_vec)[0]
+    similarity = candidates @ candidates.T
+
+    picked = np.zeros(len(candidates), dtype=bool)
+    max_sim = np.full(len(candidates), -np.inf)
+    selected = []
+
+    for _ in range(min(top_k, len(candidates))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        else:
+            scores = relevance.copy()
+        scores[picked] = -np.inf
+
+        best = int(np.argmax(scores))
+        selected.append(best)
+        picked[best] = True
+        max_sim = np.maximum(max_sim, similarity[best])
+
+    return selected
+
+def relevant_count(distances):
+    # IndexFlatL2 returns squared L2 and the MiniLM vectors are unit length,
+    # so cosine similarity = 1 - d / 2; distances come sorted, best first
+    similarity = [1 - float(d) / 2 for d in distances]
+    count = 0
+    for s in similarity:
+        if s < ADAPTIVE_MIN_SIMILARITY or s < similarity[0] * (1 - ADAPTIVE_MAX_DROP):
+            break
+        count += 1
+    return count
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
+# Query expansion
 
-def retrieve_chunks(query, top_k=TOP_K):
-    q_vec = embedder.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(q_vec, top_k)
-    return [DOCUMENT_CHUNKS[i] for i in indices[0]]
+STOPWORDS = {
+    "the", "and", "are", "was", "were", "what", "why", "how", "who", "when", "where",
+    "which", "does", "did", "can", "could", "would", "should", "for", "with", "about",
+    "from", "into", "that", "this", "these", "those", "they", "them", "their", "its",
+    "is", "it", "of", "to", "in", "on", "a", "an", "be", "do", "so", "as", "at", "by",
+    "current", "memory", "summary", "include", "includes", "including", "while"
+}
+PRONOUN_RE = re.compile(r"\b(they|them|it|this|that|these|those)\b", re.IGNORECASE)
 
-# Memory Summarizer
+def keywords(text):
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOPWORDS and len(w) > 2]
 
-def update_memory(old_memory, user_msg, assistant_msg):
-    prompt = f"""
+def rule_expansions(query, context=""):
+    terms = keywords(query)
+    expansions = [" ".join(terms)]
 
-    Current Memory:
-    {old_memory}
+    # follow-ups ("Why are they dangerous?") borrow the topic from the conversation
+    topic = [w for w, n in Counter(keywords(context)).most_common(CONTEXT_TERMS + len(terms)) if w not in terms]
+    topic = topic[:CONTEXT_TERMS]
+    if topic:
+        if PRONOUN_RE.search(query):
+            expansions.append(PRONOUN_RE.sub(" ".join(topic), query, count=1))
+        expansions.append(" ".join(terms + topic))
+    return expansions
 
-    New interaction:
-    User: {user_msg}
-    Assistant: {assistant_msg}
+def llm_expansions(query, context=""):
+    prompt = f"""
+    Rewrite the question as {MAX_EXPANSIONS - 1} different standalone search queries.
+    Replace pronouns with what they refer to in the conversation summary.
 
-    Update the memory summary briefly:
+    Conversation summary: {context or "(none)"}
+    Question: {query}
+
+    Return one query per line and nothing else.
     """
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages = [{"role":"user", "content": prompt}]
     )
-    return response.choices[0].message.content
+    lines = response.choices[0].message.content.splitlines()
+    return [line.strip().lstrip("-*0123456789.) ").strip() for line in lines]
+
+def expand_query(query, context="", use_llm=EXPANSION_LLM):
+    key = (" ".join(query.lower().split()), " ".join(context.lower().split()))
+    with _expansion_lock:
+        if key in _expansion_cache:
+            _expansion_cache.move_to_end(key)
+            return _expansion_cache[key]
+
+    candidates = llm_expansions(query, context) if use_llm else rule_expansions(query, context)
+
+    # the original query always goes first; drop empties and repeats
+    expansions, seen = [query], {key[0]}
+    for q in candidates:
+        normalized = " ".join(q.lower().split())
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            expansions.append(q)
+    expansions = expansions[:MAX_EXPANSIONS]
+
+    with _expansion_lock:
+        _expansion_cache[key] = expansions
+        while len(_expansion_cache) > EXPANSION_CACHE_SIZE:
+            _expansion_cache.popitem(last=False)
+    return expansions
+
+def fuse_rankings(rankings):
+    fused = {}
+    for ids in rankings:
+        for rank, idx in enumerate(ids, start=1):
+            fused[idx] = fused.get(idx, 0.0) + 1 / (RRF_K + rank)
+    return sorted(fused.items(), key = lambda x:x[1], reverse=True)
+
+def retrieve_chunks(query, top_k=TOP_K, diversify=MMR_ENABLED, adaptive=ADAPTIVE_TOP_K, expand=QUERY_EXPANSION):
+    queries = expand_query(query, memory_context()) if expand else [query]
+
+    # every reformulation in one encode call and one stacked search
+    query_vecs = get_embedder().encode(queries, convert_to_numpy=True)
+    search_index = get_index()
+
+    fetch_k = top_k * MMR_FETCH_FACTOR if diversify else top_k
+    if adaptive:
+        fetch_k = max(fetch_k, ADAPTIVE_FETCH_K)
+    distances, indices = search_chunks(query_vecs, fetch_k)
+
+    rankings, relevant = [], 0
+    for row_distances, row_ids in zip(distances, indices):
+        ids = [int(i) for i in row_ids if i != -1]
+        if adaptive and ids:
+            # each reformulation contributes only the hits that passed its cutoff
+            count = relevant_count(row_distances[:len(ids)])
+            relevant = max(relevant, count)
+            ids = ids[:max(count, ADAPTIVE_MIN_K)]
+        rankings.append(ids)
+
+    if adaptive:
+        top_k = min(max(relevant, ADAPTIVE_MIN_K), top_k, ADAPTIVE_MAX_K)
+
+    fused = fuse_rankings(rankings)
+    ids = [idx for idx, score in fused]
+
+    if diversify and ids:
+        # MMR over the fused scores, rescaled to [0, 1] to be comparable with cosine similarity
+        scores = np.array([score for idx, score in fused])
+        relevance = (scores - scores.min()) / max(scores.max() - scores.min(), 1e-12)
+        candidate_vecs = search_index.reconstruct_batch(np.array(ids, dtype="int64"))
+        ids = [ids[i] for i in mmr_select(query_vecs[:1], candidate_vecs, top_k, relevance=relevance)]
+
+    return [DOCUMENT_CHUNKS[i] for i in ids[:top_k]]
+
+# Memory Summarizer
+
+def summarize(prompt, max_tokens):
+    response = get_client().chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages = [{"role":"user", "content": prompt}],
+        max_tokens = max_tokens
+    )
+    return response.choices[0].message.content.strip()
+
+def summarize_segment(turns):
+    interactions = "\n".join(
+        f"User: {t['user']}\n    Assistant: {t['assistant']}" for t in turns
+    )
+    prompt = f"""
+    Summarize these interactions for the assistant's long-term memory.
+    Keep facts, names and open questions. At most {int(SEGMENT_TOKEN_CAP * 0.75)} words.
 
+    {interactions}
+    """
+    return summarize(prompt, SEGMENT_TOKEN_CAP)
+
+def rollup_summaries(summaries):
+    parts = "\n".join(f"- {summary}" for summary in summaries)
+    prompt = f"""
+    Merge these consecutive memory summaries into one, oldest first.
+    Keep facts, names and open questions. At most {int(ROLLUP_TOKEN_CAP * 0.75)} words.
+
+    {parts}
+    """
+    return summarize(prompt, ROLLUP_TOKEN_CAP)
+
+def render_memory(levels):
+    # oldest (most rolled up) first
+    return "\n".join(summary for level in reversed(levels) for summary in level)
+
+def load_memory():
+    global memory_summary, memory_version, memory_levels
+    if not os.path.exists(MEMORY_PATH):
+        return
+    with open(MEMORY_PATH, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    if lines:
+        latest = json.loads(lines[-1])
+        with _memory_lock:
+            memory_levels = latest.get("levels") or [[latest["summary"]]]
+            memory_summary, memory_version = render_memory(memory_levels), latest["version"]
+
+def summarize_queued():
+    global memory_summary, memory_version, memory_levels, _queued_turns
+    # closes everything queued so far as one segment; if a call fails the turns
+    # stay queued and go out with the next batch. One worker thread keeps
+    # versions in order, so memory_levels only changes here.
+    with _memory_lock:
+        turns = _recent_turns[:_queued_turns]
+        levels = [list(level) for level in memory_levels]
+    if not turns:
+        return memory_summary
+
+    # only the new segment and the rollups it completes are computed
+    if not levels:
+        levels.append([])
+    levels[0].append(summarize_segment(turns))
+    level = 0
+    while len(levels[level]) >= ROLLUP_FANOUT:
+        rolled = rollup_summaries(levels[level][:ROLLUP_FANOUT])
+        levels[level] = levels[level][ROLLUP_FANOUT:]
+        if level + 1 == len(levels):
+            levels.append([])
+        levels[level + 1].append(rolled)
+        level += 1
+
+    with _memory_lock:
+        memory_levels = levels
+        memory_summary = render_memory(levels)
+        memory_version += 1
+        del _recent_turns[:len(turns)]
+        _queued_turns -= len(turns)
+        record = {
+            "version": memory_version,
+            "summary": memory_summary,
+            "levels": levels,
+            "turns": len(turns),
+            "created_at": time.time()
+        }
+
+    with open(MEMORY_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    return memory_summary
+
+def submit_pending():
+    global _queued_turns
+    with _memory_lock:
+        if _queued_turns == len(_recent_turns):
+            return None
+        _queued_turns = len(_recent_turns)
+    future = _summary_pool.submit(summarize_queued)
+    future.add_done_callback(report_summary_failure)
+    return future
+
+def report_summary_failure(future):
+    # nothing waits on the future during a conversation, so say it here
+    error = future.exception()
+    if error is not None:
+        print(f"\nMemory summarization failed, turns stay queued: {type(error).__name__}: {error}")
+
+def record_turn(user_msg, assistant_msg):
+    with _memory_lock:
+        _recent_turns.append({"user": user_msg, "assistant": assistant_msg})
+        pending = _recent_turns[_queued_turns:]
+        tokens = sum(count_tokens(t["user"]) + count_tokens(t["assistant"]) for t in pending)
+    if len(pending) >= SUMMARY_EVERY_TURNS or tokens >= SUMMARY_EVERY_TOKENS:
+        submit_pending()
+
+def flush_memory():
+    # fold whatever is left before exiting
+    future = submit_pending()
+    if future:
+        future.result()
+    _summary_pool.shutdown(wait=True)
+
+def memory_context():
+    # same content as memory_messages(), as one text for query expansion; the
+    # summary can lag a few turns behind, the recent turns cover the gap
+    with _memory_lock:
+        summary, turns = memory_summary, list(_recent_turns)
+    parts = [summary] if summary else []
+    parts.extend(f"{t['user']}\n{t['assistant']}" for t in turns)
+    return "\n".join(parts)
+
+def memory_messages():
+    # latest finished summary, plus the turns it does not cover yet verbatim
+    with _memory_lock:
+        summary, turns = memory_summary, list(_recent_turns)
+    messages = []
+    if summary:
+        messages.append({"role":"assistant", "content": f"Memory summary: {summary}"})
+    for t in turns:
+        messages.append({"role":"user", "content": t["user"]})
+        messages.append({"role":"assistant", "content": t["assistant"]})
+    return messages
+
+
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
 
 tools = [
     {
@@ -99,19 +662,28 @@ SYSTEM = {
 }
 
 def call_model(messages):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = messages,
         tools = tools
     )
 
+def retrieve_context(args):
+    context, pack_stats = pack_context(retrieve_chunks(**args))
+    print("Context tokens:", pack_stats)
+    return context
+
+def context_message(query):
+    return {
+        "role": "system",
+        "content": "Retrieved context (call retrieve_chunks if you need more):\n\n" + retrieve_context({"query": query})
+    }
+
 def run_agent(query):
-    global memory_summary
-    
     messages = [SYSTEM]
-    if memory_summary:
-        messages.append({"role":"assistant", "content": f"Memory summary: {memory_summary}"})
-
+    messages.extend(memory_messages())
+    if PRE_RETRIEVAL:
+        messages.append(context_message(query))
     messages.append({"role":"user", "content":query})
 
     while True:
@@ -120,19 +692,15 @@ def run_agent(query):
 
         if msg.content:
             print("\n Final Answer: ", msg.content)
-            
-            memory_summary = update_memory(memory_summary,query, msg.content)
-            print("\n Updated Memory Summary:", memory_summary)
+
+            # summarized in the background; the next question does not wait for it
+            record_turn(query, msg.content)
             break
 
         if msg.tool_calls:
             for call in msg.tool_calls:
                 args = json.loads(call.function.arguments)
-                results = retrieve_chunks(**args)
-
-                context = "\n\n".join(
-                    f"[{r['file']}]\n{r['content']}" for r in results
-                )
+                context = retrieve_context(args)
 
                 messages.append({"role":"assistant", "tool_calls": msg.tool_calls})
                 messages.append({
@@ -141,11 +709,17 @@ def run_agent(query):
                     "content": context
                 })
 
-while True:
-    q= input("\n Ask a question (or type 'exit'): ")
-    if q.lower() =="exit":
-        break
-    run_agent(q)
+if __name__ == "__main__":
+    # load the model and index while the user types the first question
+    warmup()
+    load_memory()
+    while True:
+        q= input("\n Ask a question (or type 'exit'): ")
+        if q.lower() =="exit":
+            flush_memory()
+            print("\n Memory Summary:", memory_summary)
+            break
+        run_agent(q)
 
 
 # Expected Output:-
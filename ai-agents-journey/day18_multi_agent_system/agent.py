@@ -1,18 +1,113 @@
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-import faiss
-import os,json
+import os,re,sys,json,threading
 from dotenv import load_dotenv
+import numpy as np
 
 load_dotenv()
 
-client = Groq(api_key = os.getenv("GROQ_API_KEY"))
-
 DOCS_PATH = "./docs"
 CHUNK_SIZE = 120
 TOP_K = 3
 
-embedder = SentenceTransformer("all-MiniLm-L6-v2")
+# Adaptive top_k: look at the ADAPTIVE_FETCH_K nearest chunks and return only the
+# ones with cosine similarity >= ADAPTIVE_MIN_SIMILARITY that are within
+# ADAPTIVE_MAX_DROP (relative) of the best hit; at least ADAPTIVE_MIN_K, at most
+# ADAPTIVE_MAX_K and never more than the requested top_k
+ADAPTIVE_TOP_K = True
+ADAPTIVE_MIN_K = 1
+ADAPTIVE_MAX_K = 8
+ADAPTIVE_FETCH_K = 10
+ADAPTIVE_MIN_SIMILARITY = 0.3
+ADAPTIVE_MAX_DROP = 0.3
+
+# Two-level retrieval: route the query to the ROUTE_TOP_FILES files whose
+# centroid (mean of their chunk vectors) is closest, then search only those
+# files' chunk indexes. Search cost grows with files routed, not corpus size.
+# Trade-off: the per-file shards hold a second copy of every chunk vector next
+# to the flat index (kept for MMR and the flat fallback), so vector memory
+# doubles while this is on.
+HIERARCHICAL_ENABLED = False
+ROUTE_TOP_FILES = 8
+
+# Fan-out: the numbered plan is parsed into steps (at most MAX_STEPS) and each
+# step goes to its own sub-worker with a retrieval targeted at that step and a
+# STEP_CONTEXT_BUDGET-token context; at most MAX_PARALLEL_STEPS run at once.
+# An aggregator call merges their answers. Plans with fewer than two steps
+# fall back to the single worker.
+FAN_OUT = True
+MAX_STEPS = 10
+MAX_PARALLEL_STEPS = 4
+STEP_CONTEXT_BUDGET = 600
+
+# The pipeline runs as a DAG on orchestrator.py: ready nodes run in parallel
+# (at most MAX_PARALLEL_STEPS at a time) and node outputs are memoized by their
+# inputs, up to NODE_CACHE_SIZE of them, so asking again skips unchanged work.
+NODE_CACHE_SIZE = 1000
+
+# Plan cache (plan_cache.py): a question whose embedding is within
+# PLAN_CACHE_THRESHOLD (cosine) of an earlier one reuses that plan, with the
+# question's own words filled into the plan template, and skips the planner
+# call. At most PLAN_CACHE_SIZE plans, saved to PLAN_CACHE_PATH.
+PLAN_CACHE_ENABLED = True
+PLAN_CACHE_THRESHOLD = 0.85
+PLAN_CACHE_SIZE = 1000
+PLAN_CACHE_PATH = "./plan_cache.jsonl"
+
+# Heavy dependencies (groq, sentence_transformers, faiss) are loaded on first
+# use, so importing this module to reuse chunk_text / retrieve_chunks is cheap.
+# Call warmup() to pay the cost up front, optionally in the background.
+client = None
+embedder = None
+index = None
+DOCUMENT_CHUNKS = []
+file_index = None
+orchestrator = None
+plan_cache = None
+
+_init_lock = threading.RLock()
+
+def get_client():
+    global client
+    with _init_lock:
+        if client is None:
+            from groq import Groq
+            client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+    return client
+
+def get_embedder():
+    global embedder
+    with _init_lock:
+        if embedder is None and os.getenv("EMBEDDING_SERVER_URL"):
+            # share one batched model per machine (day19_embedding_server)
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "day19_embedding_server"))
+            from embedding_client import EmbeddingClient
+            embedder = EmbeddingClient(os.getenv("EMBEDDING_SERVER_URL"))
+        elif embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer("all-MiniLm-L6-v2")
+    return embedder
+
+def get_orchestrator():
+    global orchestrator
+    with _init_lock:
+        if orchestrator is None:
+            sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+            from orchestrator import Orchestrator
+            orchestrator = Orchestrator(max_workers=MAX_PARALLEL_STEPS, cache_size=NODE_CACHE_SIZE)
+    return orchestrator
+
+def get_plan_cache():
+    global plan_cache
+    with _init_lock:
+        if plan_cache is None:
+            sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+            from plan_cache import PlanCache
+            plan_cache = PlanCache(
+                get_embedder(),
+                threshold = PLAN_CACHE_THRESHOLD,
+                max_entries = PLAN_CACHE_SIZE,
+                path = PLAN_CACHE_PATH
+            )
+    return plan_cache
 
 def chunk_text(text):
     words = text.split()
@@ -27,25 +122,236 @@ def load_documents():
         if file.endswith(".txt"):
             with open(os.path.join(DOCS_PATH,file),"r",encoding="utf-8") as f:
                 text = f.read()
-            for chunk in chunk_text(text):
+            for i, chunk in enumerate(chunk_text(text)):
                 chunks.append({
                     "file":file,
-                    "content": chunk
+                    "content": chunk,
+                    "chunk": i
                 })
     return chunks
 
-DOCUMENT_CHUNKS = load_documents()
-
-embeddings = embedder.encode([c['content'] for c in DOCUMENT_CHUNKS], convert_to_numpy=True)
+def build_index(chunks):
+    import faiss
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
+    embeddings = get_embedder().encode(
+        [c["content"] for c in chunks],
+        convert_to_numpy = True
+    )
 
-def retrieve_chunks(query, top_k=TOP_K):
-    q_vec = embedder.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(q_vec, top_k)
-    return [DOCUMENT_CHUNKS[i] for i in indices[0]]
+    dimension = embeddings.shape[1]
+    new_index = faiss.IndexFlatL2(dimension)
+    new_index.add(embeddings)
+    return new_index
+
+def get_index():
+    global index, DOCUMENT_CHUNKS
+    with _init_lock:
+        if index is None:
+            DOCUMENT_CHUNKS = load_documents()
+            index = build_index(DOCUMENT_CHUNKS)
+    return index
+
+def build_file_index(chunks, chunk_index):
+    import faiss
+
+    # reuse the stored chunk vectors instead of re-encoding, one file at a time
+    # so there is never a third full copy of them
+    by_file = {}
+    for i, chunk in enumerate(chunks):
+        by_file.setdefault(chunk["file"], []).append(i)
+
+    files, shards, centroids = [], [], []
+    for file, ids in by_file.items():
+        ids = np.array(ids, dtype="int64")
+        vectors = chunk_index.reconstruct_batch(ids)
+        shard = faiss.IndexFlatL2(vectors.shape[1])
+        shard.add(vectors)
+        files.append(file)
+        shards.append((shard, ids))
+        centroids.append(vectors.mean(axis=0))
+
+    # unit-length centroids, so routing ranks files by cosine similarity
+    centroids = np.array(centroids, dtype="float32")
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    router = faiss.IndexFlatL2(centroids.shape[1])
+    router.add(centroids)
+
+    return {"router": router, "files": files, "shards": shards}
+
+def get_file_index():
+    global file_index
+    with _init_lock:
+        if file_index is None:
+            chunk_index = get_index()
+            file_index = build_file_index(DOCUMENT_CHUNKS, chunk_index)
+    return file_index
+
+def search_chunks(query_vec, k, hierarchical=None):
+    # same (distances, indices) shape as index.search, padded with -1;
+    # the flag is read at call time, like warmup() does
+    if hierarchical is None:
+        hierarchical = HIERARCHICAL_ENABLED
+    if not hierarchical:
+        return get_index().search(query_vec, k)
+
+    tree = get_file_index()
+    _, routed = tree["router"].search(query_vec, min(ROUTE_TOP_FILES, len(tree["shards"])))
+
+    distances, ids = [], []
+    for f in routed[0]:
+        if f == -1:
+            continue
+        shard, shard_ids = tree["shards"][f]
+        d, i = shard.search(query_vec, min(k, shard.ntotal))
+        distances.extend(d[0])
+        ids.extend(shard_ids[i[0]])
+
+    order = np.argsort(distances, kind="stable")[:k]
+    out_distances = np.full((1, k), np.finfo("float32").max, dtype="float32")
+    out_ids = np.full((1, k), -1, dtype="int64")
+    out_distances[0, :len(order)] = np.array(distances, dtype="float32")[order]
+    out_ids[0, :len(order)] = np.array(ids, dtype="int64")[order]
+    return out_distances, out_ids
+
+def warmup(background=True):
+    def load_all():
+        get_client()
+        get_index()
+        if HIERARCHICAL_ENABLED:
+            get_file_index()
+        if PLAN_CACHE_ENABLED:
+            get_plan_cache()
+
+    if not background:
+        load_all()
+        return None
+
+    thread = threading.Thread(target=load_all, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def relevant_count(distances):
+    # IndexFlatL2 returns squared L2 and the MiniLM vectors are unit length,
+    # so cosine similarity = 1 - d / 2; distances come sorted, best first
+    similarity = [1 - float(d) / 2 for d in distances]
+    count = 0
+    for s in similarity:
+        if s < ADAPTIVE_MIN_SIMILARITY or s < similarity[0] * (1 - ADAPTIVE_MAX_DROP):
+            break
+        count += 1
+    return count
+
+def retrieve_chunks(query, top_k=TOP_K, adaptive=ADAPTIVE_TOP_K):
+    q_vec = get_embedder().encode([query], convert_to_numpy=True)
+    fetch_k = max(top_k, ADAPTIVE_FETCH_K) if adaptive else top_k
+    distances, indices = search_chunks(q_vec, fetch_k)
+    ids = [int(i) for i in indices[0] if i != -1]
+
+    if adaptive and ids:
+        relevant = relevant_count(distances[0][:len(ids)])
+        top_k = min(max(relevant, ADAPTIVE_MIN_K), top_k, ADAPTIVE_MAX_K)
+
+    return [DOCUMENT_CHUNKS[i] for i in ids[:top_k]]
+
+# Context packing: drop duplicate chunks, merge neighbours from the same file
+# and keep the best-scoring chunks that fit in the token budget.
+CONTEXT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# tiktoken's cl100k_base is close to the llama-3 tokenizer; it is loaded on
+# first use and counting falls back to an estimate when it isn't installed
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # estimate: ~4 ASCII characters per token, and a token for every other
+    # character so non-English text is not undercounted
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def shingles(text, n=3):
+    words = text.split()
+    return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+def find_duplicate(entry, kept, seen):
+    if entry["normalized"] in seen:
+        return seen[entry["normalized"]]
+    for other in kept:
+        overlap = len(entry["shingles"] & other["shingles"])
+        if overlap / len(entry["shingles"] | other["shingles"]) >= NEAR_DUPLICATE_THRESHOLD:
+            return other
+    return None
+
+def pack_context(results, budget=CONTEXT_TOKEN_BUDGET):
+    stats = {
+        "chunks": len(results),
+        "input_tokens": sum(count_tokens(f"[{r['file']}]\n{r['content']}") for r in results),
+        "duplicates": 0,
+        "over_budget": 0,
+        "merged": 0
+    }
+
+    # results come in score order, so the first copy of a duplicate is the best one
+    kept, seen = [], {}
+    for rank, r in enumerate(results):
+        normalized = " ".join(r["content"].lower().split())
+        entry = {
+            "file": r["file"],
+            "chunk": r.get("chunk"),
+            "content": r["content"],
+            "files": [r["file"]],
+            "rank": rank,
+            "normalized": normalized,
+            "shingles": shingles(normalized)
+        }
+        duplicate = find_duplicate(entry, kept, seen)
+        if duplicate:
+            # keep the citation: the surviving copy is labelled with both files
+            if r["file"] not in duplicate["files"]:
+                duplicate["files"].append(r["file"])
+            stats["duplicates"] += 1
+            continue
+        seen[normalized] = entry
+        kept.append(entry)
+
+    packed, used = [], 0
+    for entry in kept:
+        cost = count_tokens(f"[{', '.join(entry['files'])}]\n{entry['content']}")
+        if used + cost > budget:
+            stats["over_budget"] += 1
+            continue
+        packed.append(entry)
+        used += cost
+
+    # consecutive chunks of one file become a single block
+    blocks = []
+    for entry in sorted(packed, key=lambda e: (e["file"], e["chunk"] if e["chunk"] is not None else e["rank"])):
+        last = blocks[-1] if blocks else None
+        if (last and entry["chunk"] is not None and last["file"] == entry["file"]
+                and last["chunk"] == entry["chunk"] - 1 and last["files"] == entry["files"]):
+            last["content"] += " " + entry["content"]
+            last["chunk"] = entry["chunk"]
+            last["rank"] = min(last["rank"], entry["rank"])
+            stats["merged"] += 1
+        else:
+            blocks.append(dict(entry))
+    blocks.sort(key=lambda b: b["rank"])
+
+    context = "\n\n".join(f"[{', '.join(b['files'])}]\n{b['content']}" for b in blocks)
+    stats["tokens"] = count_tokens(context) if blocks else 0
+    return context, stats
 
 def planner_agent(user_query):
     prompt = f"""
@@ -54,10 +360,11 @@ def planner_agent(user_query):
 
     user question: {user_query}
 
-    Return a numbered plan.
+    Return a numbered plan. Keep the steps independent of each other, one
+    line each; combining the results is done after the steps.
     """
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = [{"role":"user","content":prompt}]
     )
@@ -65,12 +372,25 @@ def planner_agent(user_query):
     return response.choices[0].message.content
 
 
-def worker_agent(plan, user_query):
-    retrieved_chunks = retrieve_chunks(user_query)
+def cached_planner(user_query):
+    if not PLAN_CACHE_ENABLED:
+        return planner_agent(user_query)
 
-    context = "\n\n".join(
-        f"[{c['file']}]\n{c['content']}" for c in retrieved_chunks
-    )
+    cache = get_plan_cache()
+    plan = cache.get(user_query)
+    if plan is None:
+        plan = planner_agent(user_query)
+        cache.put(user_query, plan)
+    print("Plan cache:", cache.stats())
+    return plan
+
+def worker_agent(plan, user_query, retrieved_chunks=None):
+    # retrieval does not depend on the plan; run_agent fetches it alongside planning
+    if retrieved_chunks is None:
+        retrieved_chunks = retrieve_chunks(user_query)
+
+    context, pack_stats = pack_context(retrieved_chunks)
+    print("Context tokens:", pack_stats)
 
     prompt = f"""
     You are a worker agent.
@@ -83,24 +403,137 @@ def worker_agent(plan, user_query):
     Answer the user clearly.
     """
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model = "llama-3.3-70b-versatile",
         messages = [{"role":"user", "content":prompt}]
     )
     return response.choices[0].message.content
 
 
+STEP_RE = re.compile(r"^\s*(\d+)[.)]\s+(.*)")
+
+def parse_plan(plan, max_steps=MAX_STEPS):
+    # "1. **Title**: do this" -> {"step": 1, "text": "Title: do this"}; lines
+    # right below a step continue it, a blank line ends it
+    steps, current = [], None
+    for line in plan.splitlines():
+        match = STEP_RE.match(line)
+        if match:
+            current = {"step": int(match.group(1)), "text": match.group(2)}
+            steps.append(current)
+        elif not line.strip():
+            current = None
+        elif current:
+            current["text"] += " " + line.strip()
+    for step in steps:
+        step["text"] = step["text"].replace("**", "").strip()
+    return [step for step in steps if step["text"]][:max_steps]
+
+def step_worker(step, user_query):
+    # targeted retrieval: the step says what to look for better than the question
+    context, pack_stats = pack_context(retrieve_chunks(step["text"]), budget=STEP_CONTEXT_BUDGET)
+    print(f"Step {step['step']} context tokens:", pack_stats)
+
+    prompt = f"""
+    You are a worker agent working on one step of a plan.
+
+    User question: {user_query}
+    Your step: {step['text']}
+
+    Use the following context:
+    {context}
+
+    Answer only your step, briefly.
+    """
+
+    response = get_client().chat.completions.create(
+        model = "llama-3.3-70b-versatile",
+        messages = [{"role":"user", "content":prompt}]
+    )
+    return response.choices[0].message.content
+
+def aggregator_agent(user_query, steps, outputs):
+    findings = "\n\n".join(
+        f"Step {step['step']}: {step['text']}\n{output}" for step, output in zip(steps, outputs)
+    )
+    prompt = f"""
+    You are an aggregator agent.
+    Merge the workers' findings into one answer to the user's question.
+
+    User question: {user_query}
+
+    Findings:
+    {findings}
+
+    Answer the user clearly.
+    """
+
+    response = get_client().chat.completions.create(
+        model = "llama-3.3-70b-versatile",
+        messages = [{"role":"user", "content":prompt}]
+    )
+    return response.choices[0].message.content
+
+def plan_steps(plan, fan_out):
+    return parse_plan(plan) if fan_out else []
+
+def step_node(i):
+    # one node per possible step; steps the plan doesn't have (or a plan that
+    # is not fanned out) finish immediately with None
+    def run(steps, user_query):
+        if len(steps) > 1 and i < len(steps):
+            return step_worker(steps[i], user_query)
+    return run
+
+def answer_node(user_query, plan, steps, retrieved_chunks, *outputs):
+    if len(steps) > 1:
+        return aggregator_agent(user_query, steps, outputs[:len(steps)])
+    return worker_agent(plan, user_query, retrieved_chunks)
+
+def build_graph():
+    from orchestrator import Graph
+
+    # planning and retrieval don't depend on each other and start together;
+    # the sub-workers start as soon as the plan is parsed. Retrieval runs even
+    # with fan-out (one embedding + search): a plan too short to fan out falls
+    # back to a single worker, which then doesn't wait on a search of its own
+    graph = Graph()
+    graph.node("plan", cached_planner, ["query"])
+    graph.node("retrieve", retrieve_chunks, ["query"])
+    graph.node("steps", plan_steps, ["plan", "fan_out"])
+    step_names = [f"step_{i + 1}" for i in range(MAX_STEPS)]
+    for i, name in enumerate(step_names):
+        graph.node(name, step_node(i), ["steps", "query"])
+    graph.node("answer", answer_node, ["query", "plan", "steps", "retrieve"] + step_names)
+    return graph
+
 def run_agent(query):
+    # settings that change a node's output are inputs too, so memoized outputs
+    # are reused only under the same settings
+    results, trace = get_orchestrator().run(build_graph(), {"query": query, "fan_out": FAN_OUT})
+
     print("\n....Planner Output....")
-    plan = planner_agent(query)
-    print(plan)
+    print(results["plan"])
 
-    print("\n....Worker Output....")
-    answer = worker_agent(plan, query)
+    steps = results["steps"]
+    print(f"\n....{len(steps)} Sub-workers...." if len(steps) > 1 else "\n....Worker Output....")
+    answer = results["answer"]
     print("\nFinal Answer:\n", answer)
 
-query = "What are the threats to ocean health and why are they dangerous?"
-run_agent(query)
+    # skipped step nodes (None) are left out
+    nodes = {name: node for name, node in trace["nodes"].items() if results[name] is not None}
+    print("Node latency (ms):", {name: node["ms"] for name, node in nodes.items() if not node["cached"]})
+    print("Memoized:", [name for name, node in nodes.items() if node["cached"]])
+    if trace["critical_path"]:
+        print("Critical path:", " -> ".join(trace["critical_path"]), f"({trace['critical_ms']} ms of {trace['total_ms']} ms)")
+    else:
+        print("Critical path: none, every node was memoized")
+    return answer
+
+if __name__ == "__main__":
+    warmup()
+    query = "What are the threats to ocean health and why are they dangerous?"
+    run_agent(query)
 
 
 # Expected output:-
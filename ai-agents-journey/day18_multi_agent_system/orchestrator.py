@@ -0,0 +1,173 @@
+# Small DAG orchestrator for the multi-agent pipeline.
+#
+# Agents and tools are declared as nodes; a node names the nodes (or run
+# inputs) it depends on and is called with their values, in that order:
+#
+#   graph = Graph()
+#   graph.node("plan", planner_agent, ["query"])
+#   graph.node("retrieve", retrieve_chunks, ["query"])
+#   graph.node("answer", worker_agent, ["plan", "query", "retrieve"])
+#
+#   orchestrator = Orchestrator(max_workers=4)
+#   results, trace = orchestrator.run(graph, {"query": query})
+#
+# Every node whose dependencies are done is started right away on a thread
+# pool of max_workers, so independent nodes overlap without hand-written
+# concurrency. Outputs are memoized by node name + a hash of the node's input
+# values (LRU, at most cache_size entries): running the graph again, or a graph
+# where only some inputs changed, only recomputes the nodes downstream of the
+# change. Pass memoize=False for nodes that must always run.
+#
+# The trace has each node's start and latency (ms from the start of the run),
+# whether it came from the cache, and the critical path: the chain of nodes
+# that decided the total latency. Only nodes that actually ran are reported in
+# it; memoized nodes and nodes that returned None (skipped) are left out.
+
+import json,time,hashlib,threading
+import concurrent.futures
+from collections import OrderedDict
+
+MAX_WORKERS = 4
+CACHE_SIZE = 1000
+
+def input_hash(name, values):
+    payload = json.dumps([name, values], sort_keys=True, default=repr)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class Graph:
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+
+    def node(self, name, fn, deps=(), memoize=True):
+        if name in self.nodes:
+            raise ValueError(f"duplicate node: {name}")
+        self.nodes[name] = {"fn": fn, "deps": list(deps), "memoize": memoize}
+        return self
+
+    def check(self, inputs):
+        # every dependency must be a node or an input, and there must be no cycle
+        for name, node in self.nodes.items():
+            for dep in node["deps"]:
+                if dep not in self.nodes and dep not in inputs:
+                    raise ValueError(f"node {name} depends on unknown {dep}")
+
+        state = {}
+        def visit(name, path):
+            if state.get(name) == "done" or name not in self.nodes:
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("cycle: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dep in self.nodes[name]["deps"]:
+                visit(dep, path + [name])
+            state[name] = "done"
+
+        for name in self.nodes:
+            visit(name, [])
+
+class Orchestrator:
+
+    def __init__(self, max_workers=MAX_WORKERS, cache_size=CACHE_SIZE):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return True, self.cache[key]
+        return False, None
+
+    def store(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def run(self, graph, inputs):
+        graph.check(inputs)
+        results = dict(inputs)
+        trace = {}
+        pending = OrderedDict((name, node) for name, node in graph.nodes.items())
+        start = time.perf_counter()
+
+        def elapsed():
+            return round((time.perf_counter() - start) * 1000, 1)
+
+        def call(node, args):
+            began = elapsed()
+            value = node["fn"](*args)
+            return value, began, elapsed()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+            while pending or running:
+                # start everything that is ready; cache hits finish on the spot,
+                # which can make more nodes ready, hence the inner loop
+                progress = True
+                while progress:
+                    progress = False
+                    for name, node in list(pending.items()):
+                        if any(dep not in results for dep in node["deps"]):
+                            continue
+                        del pending[name]
+                        args = [results[dep] for dep in node["deps"]]
+                        key = input_hash(name, args) if node["memoize"] else None
+                        hit, value = self.cached(key) if key else (False, None)
+                        if hit:
+                            now = elapsed()
+                            results[name] = value
+                            trace[name] = {"start_ms": now, "ms": 0.0, "cached": True}
+                            progress = True
+                        else:
+                            running[pool.submit(call, node, args)] = (name, key)
+
+                if not running:
+                    if pending:
+                        raise RuntimeError("stuck nodes: " + ", ".join(pending))
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name, key = running.pop(future)
+                    try:
+                        value, began, ended = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    results[name] = value
+                    trace[name] = {"start_ms": began, "ms": round(ended - began, 1), "cached": False}
+                    if key:
+                        self.store(key, value)
+
+        for name in graph.nodes:
+            trace[name]["end_ms"] = round(trace[name]["start_ms"] + trace[name]["ms"], 1)
+        ran = {name for name in graph.nodes if not trace[name]["cached"] and results[name] is not None}
+        path = critical_path(graph, trace, ran)
+        return results, {
+            "nodes": trace,
+            "critical_path": path,
+            "critical_ms": round(sum(trace[name]["ms"] for name in path), 1),
+            "total_ms": elapsed()
+        }
+
+def critical_path(graph, trace, ran):
+    # walk back from the node that finished last, each time through the
+    # dependency that finished last (the one the node was waiting for); nodes
+    # that didn't run are walked through but not reported
+    if not ran:
+        return []
+    name = max(ran, key=lambda n: trace[n]["end_ms"])
+    path = [name]
+    while True:
+        deps = [dep for dep in graph.nodes[name]["deps"] if dep in graph.nodes]
+        if not deps:
+            break
+        name = max(deps, key=lambda n: (trace[n]["end_ms"], n in ran))
+        path.append(name)
+    path.reverse()
+    return [name for name in path if name in ran]
@@ -0,0 +1,208 @@
+# Plan cache: questions shaped like one already planned reuse its plan instead
+# of paying for a planner call.
+#
+# A lookup embeds the question with the agent's embedder and searches a small
+# FAISS index of earlier questions; the best match is served if its cosine
+# similarity is >= threshold.
+#
+# Plans are stored as templates: every content word of the question that also
+# appears in the plan becomes a slot (<<i>>, i = word position in the question,
+# <<i^>> if it was capitalized). On a hit the new question is aligned word by
+# word with the cached one and the slots are refilled from it, so
+#
+#   "What are the threats to ocean health?"   ->  "... pollution of <<5>> <<6>> ..."
+#   "What are the threats to coral reefs?"    ->  "... pollution of coral reefs ..."
+#
+# Only word-for-word substitutions are filled in. If a slot word was dropped or
+# sits in a span that changed length ("What threatens ocean health?"), the
+# template can't be filled safely and the lookup counts as a miss.
+#
+# At most max_entries plans are kept, least recently used go first. With a
+# path, every new plan is appended to a JSONL file that is replayed on start;
+# the file is compacted once it holds COMPACT_FACTOR times max_entries lines.
+#
+#   cache = PlanCache(embedder, path="./plan_cache.jsonl")
+#   plan = cache.get(query) or planner_agent(query)
+#   cache.put(query, plan)
+#   cache.stats()
+
+import os,re,json,time,difflib,threading
+from collections import OrderedDict
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.85
+MAX_ENTRIES = 1000
+COMPACT_FACTOR = 2
+
+STOPWORDS = {
+    "the", "and", "are", "was", "were", "what", "why", "how", "who", "when", "where",
+    "which", "does", "did", "can", "could", "would", "should", "for", "with", "about",
+    "from", "into", "that", "this", "these", "those", "they", "them", "their", "its",
+    "is", "it", "of", "to", "in", "on", "a", "an", "be", "do", "so", "as", "at", "by"
+}
+SLOT_RE = re.compile(r"<<(\d+)(\^?)>>")
+
+def query_words(query):
+    return re.findall(r"\w+", query.lower())
+
+def is_content(word):
+    return word not in STOPWORDS and len(word) > 2
+
+def make_template(query, plan):
+    template = plan
+    for i, word in enumerate(query_words(query)):
+        if is_content(word):
+            template = re.sub(
+                rf"\b{re.escape(word)}\b",
+                lambda m, i=i: f"<<{i}^>>" if m.group(0)[0].isupper() else f"<<{i}>>",
+                template,
+                flags = re.IGNORECASE
+            )
+    return template
+
+def fill_template(template, cached_query, query):
+    # cached word position -> what stands there in the new question; None if a
+    # slot can't be filled word for word or the question's wording around the
+    # content words changed (the plan's sentences would no longer fit)
+    old, new = query_words(cached_query), query_words(query)
+    written = re.findall(r"\w+", query)  # the new words as the user wrote them
+    if len(written) != len(new):
+        return None  # lowercasing split or merged a word, positions don't line up
+    slots = {int(m.group(1)) for m in SLOT_RE.finditer(template)}
+    fills = {i: word for i, word in enumerate(old)}
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(a=old, b=new, autojunk=False).get_opcodes():
+        if op in ("equal", "insert"):
+            continue
+        if op == "replace" and i2 - i1 == j2 - j1:
+            pairs = list(zip(old[i1:i2], new[j1:j2]))
+            if slots.intersection(range(i1, i2)) and not all(is_content(o) and is_content(n) for o, n in pairs):
+                return None
+            fills.update({i1 + k: written[j1 + k] for k in range(i2 - i1)})
+        elif slots.intersection(range(i1, i2)):
+            return None
+
+    def fill(match):
+        word = fills.get(int(match.group(1)), "")
+        return word[:1].upper() + word[1:] if match.group(2) else word
+
+    plan = SLOT_RE.sub(fill, template)
+    plan = re.sub(r"[ \t]{2,}", " ", plan)
+    return re.sub(r"[ \t]+([.,;:!?])", r"\1", plan)
+
+class PlanCache:
+
+    def __init__(self, embedder, threshold=SIMILARITY_THRESHOLD, max_entries=MAX_ENTRIES, path=None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+
+        self.index = None
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.RLock()
+        self.metrics = {
+            "lookups": 0,
+            "hits": 0,
+            "templated": 0,
+            "misses": 0,
+            "unfillable": 0,
+            "evicted": 0
+        }
+        self.logged = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def encode(self, texts):
+        vectors = np.asarray(self.embedder.encode(texts, convert_to_numpy=True), dtype="float32")
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def add(self, vector, entry):
+        # vector: (1, dim), normalized
+        import faiss
+
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+        entry_id = self.next_id
+        self.next_id += 1
+        self.index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+        self.entries[entry_id] = dict(entry, vector=vector[0])
+
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self.index.remove_ids(np.array([oldest], dtype="int64"))
+            del self.entries[oldest]
+            self.metrics["evicted"] += 1
+
+    def get(self, query):
+        query_vec = self.encode([query])
+        with self.lock:
+            self.metrics["lookups"] += 1
+            if not self.entries:
+                self.metrics["misses"] += 1
+                return None
+
+            scores, ids = self.index.search(query_vec, 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            if entry_id == -1 or score < self.threshold:
+                self.metrics["misses"] += 1
+                return None
+
+            entry = self.entries[entry_id]
+            plan = fill_template(entry["template"], entry["query"], query)
+            if plan is None:
+                self.metrics["unfillable"] += 1
+                self.metrics["misses"] += 1
+                return None
+
+            self.entries.move_to_end(entry_id)
+            entry["hits"] += 1
+            self.metrics["hits"] += 1
+            if query_words(query) != query_words(entry["query"]):
+                self.metrics["templated"] += 1
+            return plan
+
+    def put(self, query, plan):
+        query_vec = self.encode([query])
+        entry = {
+            "query": query,
+            "template": make_template(query, plan),
+            "created_at": time.time(),
+            "hits": 0
+        }
+        with self.lock:
+            self.add(query_vec, entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(dict(entry, vector=query_vec[0].tolist())) + "\n")
+                self.logged += 1
+                if self.logged > COMPACT_FACTOR * self.max_entries:
+                    self.compact()
+
+    def compact(self):
+        # rewrite the log with only the live entries; write then rename, so a
+        # crash never leaves half a file behind
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(dict(entry, vector=entry["vector"].tolist())) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        self.logged = len(self.entries)
+
+    def load(self):
+        # replayed oldest first, so the LRU keeps the most recent plans
+        with self.lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    vector = np.array([entry.pop("vector")], dtype="float32")
+                    self.add(vector, entry)
+                    self.logged += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["entries"] = len(self.entries)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        return stats
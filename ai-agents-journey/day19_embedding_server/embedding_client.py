@@ -0,0 +1,52 @@
+# Client for the local embedding server (server.py).
+#
+# EmbeddingClient.encode() mirrors SentenceTransformer.encode(), so the agents
+# can swap it in for their embedder without touching retrieve_chunks:
+#
+#   embedder = EmbeddingClient("http://127.0.0.1:8765")
+#   vectors = embedder.encode(["some text"], convert_to_numpy=True)
+
+import os,json,time,base64,urllib.request,urllib.error
+import numpy as np
+
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL", "http://127.0.0.1:8765")
+
+class EmbeddingClient:
+
+    def __init__(self, url=EMBEDDING_SERVER_URL, timeout=60, retries=5):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+
+    def post(self, texts):
+        request = urllib.request.Request(
+            self.url + "/embed",
+            data = json.dumps({"texts": texts}).encode("utf-8"),
+            headers = {"Content-Type": "application/json"}
+        )
+
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                # 503 = server queue is full; back off and try again
+                if e.code != 503 or attempt == self.retries:
+                    raise
+                time.sleep(float(e.headers.get("Retry-After", 1)) * (attempt + 1) / 4)
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        payload = self.post(texts)
+        vectors = np.frombuffer(
+            base64.b64decode(payload["embeddings"]),
+            dtype = np.float32
+        ).reshape(payload["shape"])
+
+        return vectors[0] if single else vectors
+
+    def metrics(self):
+        with urllib.request.urlopen(self.url + "/metrics", timeout=self.timeout) as response:
+            return json.loads(response.read())
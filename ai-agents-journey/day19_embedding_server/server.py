@@ -0,0 +1,246 @@
+# Local embedding server shared by all the RAG agents.
+#
+# Instead of every agent process loading its own copy of MiniLM and encoding
+# queries one at a time, the model is loaded once per machine and served over
+# localhost HTTP. Concurrent requests are micro-batched:
+#
+#   collect requests for up to MAX_WAIT_MS, or until MAX_BATCH texts are queued
+#   ↓
+#   one embedder.encode() call for the whole batch
+#   ↓
+#   split the vectors back to the waiting requests
+#
+# Endpoints:
+#   POST /embed    {"texts": [...]}  ->  {"shape": [n, dim], "embeddings": <base64 float32>}
+#   GET  /metrics  batch sizes, per-batch latency percentiles, queue depth, rejects
+#   GET  /health
+#
+# When more than MAX_QUEUE requests are waiting the server answers 503 with a
+# Retry-After header instead of queueing forever (backpressure).
+#
+# Run:   python server.py
+# Agents use it when EMBEDDING_SERVER_URL is set (see embedding_client.py).
+
+import os,json,time,queue,threading,base64
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+HOST = os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("EMBEDDING_SERVER_PORT", "8765"))
+MODEL_NAME = "all-MiniLm-L6-v2"
+
+MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+MAX_QUEUE = int(os.getenv("EMBEDDING_MAX_QUEUE", "256"))
+MAX_REQUEST_TEXTS = 4096
+REQUEST_TIMEOUT = 60
+
+REQUEST_QUEUE = queue.Queue(maxsize=MAX_QUEUE)
+
+METRICS = {
+    "requests": 0,
+    "texts": 0,
+    "batches": 0,
+    "rejected": 0,
+    "errors": 0,
+    "recent_batches": deque(maxlen=1000)
+}
+_metrics_lock = threading.Lock()
+
+embedder = None
+
+def load_model():
+    global embedder
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(MODEL_NAME)
+    return embedder
+
+def encode_batch(texts):
+    return embedder.encode(
+        texts,
+        batch_size = MAX_BATCH,
+        convert_to_numpy = True
+    ).astype(np.float32)
+
+# Batching
+
+def submit(texts):
+    item = {
+        "texts": texts,
+        "queued_at": time.perf_counter(),
+        "done": threading.Event(),
+        "result": None,
+        "error": None
+    }
+    # raises queue.Full when the server is saturated
+    REQUEST_QUEUE.put_nowait(item)
+
+    if not item["done"].wait(REQUEST_TIMEOUT):
+        raise TimeoutError("embedding request timed out")
+    if item["error"]:
+        raise RuntimeError(item["error"])
+    return item["result"]
+
+def collect_batch():
+    first = REQUEST_QUEUE.get()
+    batch = [first]
+    size = len(first["texts"])
+    deadline = time.perf_counter() + MAX_WAIT_MS / 1000
+
+    while size < MAX_BATCH:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            item = REQUEST_QUEUE.get(timeout=remaining)
+        except queue.Empty:
+            break
+        batch.append(item)
+        size += len(item["texts"])
+
+    return batch
+
+def batch_worker():
+    while True:
+        batch = collect_batch()
+        texts = [t for item in batch for t in item["texts"]]
+
+        start = time.perf_counter()
+        try:
+            vectors = encode_batch(texts)
+            error = None
+        except Exception as e:
+            vectors = None
+            error = str(e)
+        latency = time.perf_counter() - start
+
+        offset = 0
+        for item in batch:
+            n = len(item["texts"])
+            if error:
+                item["error"] = error
+            else:
+                item["result"] = vectors[offset:offset + n]
+            offset += n
+            item["done"].set()
+
+        with _metrics_lock:
+            METRICS["batches"] += 1
+            METRICS["requests"] += len(batch)
+            METRICS["texts"] += len(texts)
+            if error:
+                METRICS["errors"] += 1
+            METRICS["recent_batches"].append({
+                "requests": len(batch),
+                "texts": len(texts),
+                "latency_ms": latency * 1000,
+                "queue_wait_ms": (start - batch[0]["queued_at"]) * 1000
+            })
+
+def metrics_snapshot():
+    with _metrics_lock:
+        recent = list(METRICS["recent_batches"])
+        snapshot = {k: v for k, v in METRICS.items() if k != "recent_batches"}
+
+    snapshot["queue_depth"] = REQUEST_QUEUE.qsize()
+    snapshot["max_batch"] = MAX_BATCH
+    snapshot["max_wait_ms"] = MAX_WAIT_MS
+
+    if recent:
+        latencies = [b["latency_ms"] for b in recent]
+        waits = [b["queue_wait_ms"] for b in recent]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        snapshot["batch_latency_ms"] = {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        snapshot["queue_wait_ms_p95"] = float(np.percentile(waits, 95))
+        snapshot["avg_batch_texts"] = sum(b["texts"] for b in recent) / len(recent)
+        snapshot["avg_batch_requests"] = sum(b["requests"] for b in recent) / len(recent)
+
+    return snapshot
+
+# HTTP
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, default=float).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "model": MODEL_NAME})
+        elif self.path == "/metrics":
+            self.send_json(200, metrics_snapshot())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length))["texts"]
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": "expected JSON body {\"texts\": [...]}"})
+            return
+
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            self.send_json(400, {"error": "texts must be a list of strings"})
+            return
+        if len(texts) > MAX_REQUEST_TEXTS:
+            self.send_json(413, {"error": f"at most {MAX_REQUEST_TEXTS} texts per request"})
+            return
+        if not texts:
+            self.send_json(200, {"shape": [0, 0], "embeddings": ""})
+            return
+
+        try:
+            vectors = submit(texts)
+        except queue.Full:
+            with _metrics_lock:
+                METRICS["rejected"] += 1
+            self.send_json(503, {"error": "server busy"}, {"Retry-After": "1"})
+            return
+        except (TimeoutError, RuntimeError) as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.send_json(200, {
+            "shape": list(vectors.shape),
+            "embeddings": base64.b64encode(vectors.tobytes()).decode("ascii")
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default listen backlog (5) resets connections under concurrent load
+    request_queue_size = 128
+
+def run_server(host=HOST, port=PORT):
+    load_model()
+    threading.Thread(target=batch_worker, name="batch-worker", daemon=True).start()
+
+    server = EmbeddingServer((host, port), EmbeddingHandler)
+    print(f"Embedding server ({MODEL_NAME}) listening on http://{host}:{port}")
+    print(f"batching: up to {MAX_BATCH} texts or {MAX_WAIT_MS} ms, queue limit {MAX_QUEUE}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    run_server()
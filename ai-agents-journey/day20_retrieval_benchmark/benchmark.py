@@ -0,0 +1,288 @@
+# Retrieval benchmark for the four retrievers built so far:
+#
+#   keyword  - day11 sparse term-chunk matrix
+#   vector   - day12 sklearn cosine similarity
+#   faiss    - day13 FAISS flat L2
+#   hybrid   - day14 FAISS + BM25 with rank fusion
+#
+# Each retriever is loaded straight from its day folder and run offline on the
+# same corpus with labeled query -> relevant chunk pairs. For each one we report
+#
+#   recall@k and MRR@k
+#   build time
+#   index memory
+#   p50 / p95 / p99 query latency
+#
+# and write everything to a JSON file so runs can be compared over time.
+# Retrievers with adaptive top_k are run with it off, so every one of them
+# returns exactly k results and the recall/MRR columns compare like with like.
+#
+# Usage:
+#   python benchmark.py                                  # synthetic, 2000 chunks
+#   python benchmark.py --chunks 20000 --queries 500 --k 5
+#   python benchmark.py --retrievers keyword,hybrid
+#   python benchmark.py --corpus my_corpus.json          # labeled corpus
+#   python benchmark.py --save-corpus corpus.json        # keep the synthetic one
+#   python benchmark.py --out results.json
+#
+# A corpus file looks like:
+#   {"chunks":  [{"file": "a.txt", "content": "..."}, ...],
+#    "queries": [{"query": "...", "relevant": [0, 7]}, ...]}
+# where "relevant" holds indexes into "chunks".
+
+import os,sys,json,time,random,inspect,platform,tracemalloc,importlib.util
+from datetime import datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+N_CHUNKS = 2000
+N_QUERIES = 200
+TOP_K = 5
+CHUNK_SIZE = 120
+RETRIEVERS = ["keyword", "vector", "faiss", "hybrid"]
+MODEL_NAME = "all-MiniLm-L6-v2"
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "ten", "so", "vu", "pel", "dra", "ni", "qua", "mor",
+    "sil", "ex", "ba", "tor", "fi", "gen", "lu", "zan", "cor", "ve", "ist", "um"
+]
+
+# Corpus
+
+def make_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def make_corpus(n_chunks, n_queries, seed=0):
+    # Every chunk mixes common filler words, words of its topic and a few
+    # chunk-specific key words. A query uses two key words of one chunk plus
+    # two topic words, so the topic neighbours are the hard negatives.
+    rng = random.Random(seed)
+    common = [make_word(rng) for _ in range(2000)]
+    n_topics = max(n_chunks // 20, 1)
+    topics = [[make_word(rng) for _ in range(30)] for _ in range(n_topics)]
+
+    chunks, keys = [], []
+    for i in range(n_chunks):
+        topic = topics[i % n_topics]
+        key = [make_word(rng) for _ in range(5)]
+        words = rng.choices(common, k=CHUNK_SIZE - 35) + rng.choices(topic, k=20) + key * 3
+        rng.shuffle(words)
+        chunks.append({"file": f"doc{i // 10}.txt", "content": " ".join(words)})
+        keys.append(key)
+
+    queries = []
+    for _ in range(n_queries):
+        target = rng.randrange(n_chunks)
+        words = rng.sample(keys[target], 2) + rng.sample(topics[target % n_topics], 2)
+        rng.shuffle(words)
+        queries.append({"query": " ".join(words), "relevant": [target]})
+
+    return {"chunks": chunks, "queries": queries}
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Retrievers
+
+def load_agent(folder_prefix):
+    folder = next(d for d in sorted(os.listdir(ROOT)) if d.startswith(folder_prefix))
+    path = os.path.join(ROOT, folder)
+
+    # some agents read ./docs at import time
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{folder}_agent", os.path.join(path, "agent.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+class CachedEmbedder:
+    # Chunk embeddings are computed once and shared by every vector retriever,
+    # so their build times compare index construction, not the model.
+    # Anything not in the cache (the queries) goes to the real model.
+
+    def __init__(self, model, texts, vectors):
+        self.model = model
+        self.cache = dict(zip(texts, vectors))
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if all(t in self.cache for t in texts):
+            vectors = np.array([self.cache[t] for t in texts])
+        else:
+            vectors = self.model.encode(texts, convert_to_numpy=True)
+        return vectors[0] if single else vectors
+
+def faiss_bytes(index):
+    import faiss
+    return int(faiss.serialize_index(index).nbytes)
+
+def build_keyword(module, chunks, embedder):
+    module.DOCUMENT_CHUNKS = chunks
+    module.TERM_MATRIX = module.build_term_matrix(chunks)
+    return 0
+
+def build_vector(module, chunks, embedder):
+    module.embedder = embedder
+    module.DOCUMENT_CHUNKS = chunks
+    module.CHUNK_EMBEDDINGS = [embedder.encode(c["content"]).copy() for c in chunks]
+    return 0
+
+def build_faiss(module, chunks, embedder):
+    module.embedder = embedder
+    module.DOCUMENT_CHUNKS = chunks
+    module.index = module.build_index(chunks)
+    return faiss_bytes(module.index)
+
+def build_hybrid(module, chunks, embedder):
+    module.embedder = embedder
+    module.DOCUMENT_CHUNKS = chunks
+    module.index = module.build_index(chunks)
+    module.bm25_index = module.build_bm25(chunks)
+    return faiss_bytes(module.index)
+
+# name -> (day folder, modules its build imports lazily, builder)
+BUILDERS = {
+    "keyword": ("day11", ["scipy.sparse"], build_keyword),
+    "vector": ("day12", [], build_vector),
+    "faiss": ("day13", ["faiss"], build_faiss),
+    "hybrid": ("day14", ["faiss"], build_hybrid)
+}
+
+# Metrics
+
+def recall_at_k(ranked, relevant, k):
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+def reciprocal_rank(ranked, relevant, k):
+    for rank, idx in enumerate(ranked[:k], start=1):
+        if idx in relevant:
+            return 1 / rank
+    return 0.0
+
+def run_retriever(name, corpus, embedder, k):
+    chunks = [dict(c, id=i) for i, c in enumerate(corpus["chunks"])]
+
+    # load the agent and its heavy dependencies up front, so build time and
+    # index memory cover index construction only, not module import
+    folder_prefix, imports, build = BUILDERS[name]
+    module = load_agent(folder_prefix)
+    for dependency in imports:
+        importlib.import_module(dependency)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    native_bytes = build(module, chunks, embedder)
+    build_s = time.perf_counter() - start
+    python_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    options = {"top_k": k}
+    if "adaptive" in inspect.signature(module.retrieve_chunks).parameters:
+        options["adaptive"] = False
+
+    # one untimed query so lazy imports are not counted as query latency
+    module.retrieve_chunks(corpus["queries"][0]["query"], **options)
+
+    latencies, recalls, reciprocal_ranks = [], [], []
+    for q in corpus["queries"]:
+        start = time.perf_counter()
+        results = module.retrieve_chunks(q["query"], **options)
+        latencies.append(time.perf_counter() - start)
+
+        ranked = [r["id"] for r in results]
+        recalls.append(recall_at_k(ranked, q["relevant"], k))
+        reciprocal_ranks.append(reciprocal_rank(ranked, q["relevant"], k))
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        f"mrr@{k}": float(np.mean(reciprocal_ranks)),
+        "build_s": build_s,
+        "index_mb": (python_bytes + native_bytes) / 1e6,
+        "latency_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(latencies) * 1000)}
+    }
+
+def embed_corpus(corpus):
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(MODEL_NAME)
+    texts = [c["content"] for c in corpus["chunks"]]
+    start = time.perf_counter()
+    vectors = model.encode(texts, convert_to_numpy=True)
+    return CachedEmbedder(model, texts, vectors), time.perf_counter() - start
+
+def print_report(report, k):
+    print(f"\n{'retriever':<10} {'recall@' + str(k):>9} {'mrr@' + str(k):>8} {'build s':>9} {'index MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in report["results"].items():
+        if "error" in r:
+            print(f"{name:<10} failed: {r['error']}")
+            continue
+        lat = r["latency_ms"]
+        print(f"{name:<10} {r[f'recall@{k}']:9.3f} {r[f'mrr@{k}']:8.3f} {r['build_s']:9.2f} {r['index_mb']:9.2f} "
+              f"{lat['p50']:8.2f} {lat['p95']:8.2f} {lat['p99']:8.2f}")
+    if report.get("embed_s") is not None:
+        print(f"\nshared chunk embedding time (not in build s): {report['embed_s']:.2f}s")
+
+def arg(argv, name, default):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+def main(argv):
+    n_chunks = int(arg(argv, "--chunks", N_CHUNKS))
+    n_queries = int(arg(argv, "--queries", N_QUERIES))
+    k = int(arg(argv, "--k", TOP_K))
+    retrievers = arg(argv, "--retrievers", ",".join(RETRIEVERS)).split(",")
+    out_path = arg(argv, "--out", f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+
+    if "--corpus" in argv:
+        corpus = load_corpus(arg(argv, "--corpus", None))
+        source = arg(argv, "--corpus", None)
+    else:
+        corpus = make_corpus(n_chunks, n_queries, seed=int(arg(argv, "--seed", 0)))
+        source = "synthetic"
+    if "--save-corpus" in argv:
+        with open(arg(argv, "--save-corpus", None), "w", encoding="utf-8") as f:
+            json.dump(corpus, f)
+
+    print(f"corpus: {source}, {len(corpus['chunks']):,} chunks, {len(corpus['queries']):,} queries, k={k}")
+
+    embedder, embed_s = None, None
+    if any(r != "keyword" for r in retrievers):
+        embedder, embed_s = embed_corpus(corpus)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "corpus": source,
+            "chunks": len(corpus["chunks"]),
+            "queries": len(corpus["queries"]),
+            "k": k,
+            "model": MODEL_NAME,
+            "python": platform.python_version(),
+            "machine": platform.machine()
+        },
+        "embed_s": embed_s,
+        "results": {}
+    }
+
+    for name in retrievers:
+        print(f"running {name}...")
+        try:
+            report["results"][name] = run_retriever(name, corpus, embedder, k)
+        except Exception as e:
+            report["results"][name] = {"error": f"{type(e).__name__}: {e}"}
+
+    print_report(report, k)
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out_path}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
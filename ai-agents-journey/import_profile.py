@@ -0,0 +1,89 @@
+# Import-time profile for the agents in the journey.
+#
+# Each importable agent is imported in a fresh interpreter with
+# `python -X importtime` (run from its own folder, the same way the agents are
+# started), and we report the import time plus the slowest top-level imports.
+#
+# Usage:
+#   python import_profile.py                 # all days
+#   python import_profile.py day13 day14     # only matching folders
+#   python import_profile.py --top 5
+
+import os,sys,subprocess,time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOP_N = 10
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package"
+    # nested imports are indented under the package that pulled them in
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        name = name[1:]
+        if name.startswith(" "):
+            continue
+        rows.append((name, int(self_us), int(cumulative_us)))
+    return rows
+
+def is_importable(path):
+    # agents without a __main__ guard run the whole demo (and call the API) on import
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        return 'if __name__ == "__main__":' in f.read()
+
+def profile_agent(folder):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import agent"],
+        cwd = os.path.join(ROOT, folder),
+        capture_output = True,
+        text = True
+    )
+    wall = time.perf_counter() - start
+
+    rows = parse_importtime(proc.stderr)
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1]
+
+    return {
+        "folder": folder,
+        "wall_s": wall,
+        "import_s": sum(r[2] for r in rows) / 1e6,
+        "top": sorted(rows, key=lambda r: r[2], reverse=True),
+        "error": error
+    }
+
+def print_report(results, top_n=TOP_N):
+    for r in results:
+        status = f"FAILED ({r['error']})" if r["error"] else "ok"
+        print(f"\n{r['folder']}: {r['import_s']:.3f}s in imports, {r['wall_s']:.3f}s wall  [{status}]")
+        for name, self_us, cumulative_us in r["top"][:top_n]:
+            print(f"    {cumulative_us / 1000:9.1f} ms  {name}")
+
+    print("\nSummary (slowest first):")
+    for r in sorted(results, key=lambda r: r["import_s"], reverse=True):
+        print(f"    {r['import_s']:7.3f}s  {r['folder']}")
+
+def main(argv):
+    top_n = TOP_N
+    if "--top" in argv:
+        i = argv.index("--top")
+        top_n = int(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+
+    folders = sorted(
+        d for d in os.listdir(ROOT)
+        if d.startswith("day") and is_importable(os.path.join(ROOT, d, "agent.py"))
+    )
+    if argv:
+        folders = [d for d in folders if any(d.startswith(a) for a in argv)]
+
+    print_report([profile_agent(d) for d in folders], top_n)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])